@@ -0,0 +1,95 @@
+# async_db.py
+#
+# Awaitable versions of the db_functions/report_data calls the handlers make.
+# sqlite3 blocks, so each call runs on one of DB_THREADS threads (every thread
+# keeps its own connection, see get_connection()) while the event loop goes on
+# with other updates. Cached profiles are answered without leaving the loop.
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import db_functions
+import report_data
+import transaction_import
+from constants import DB_THREADS, IMPORT_CONCURRENCY
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _run_in_db_thread(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+async def get_user_profile(user_id):
+    profile = db_functions.get_cached_user_profile(user_id)
+    if profile is db_functions.NOT_CACHED:
+        profile = await run_db(db_functions.get_user_profile, user_id)
+    return profile
+
+
+async def get_user_language(user_id):
+    profile = await get_user_profile(user_id)
+    if profile:
+        return profile.language
+    else:
+        return None
+
+
+async def is_first_time_user(user_id):
+    profile = await get_user_profile(user_id)
+    if profile:
+        return bool(profile.first_time)
+    else:
+        return True  # Default to True if user not found
+
+
+async def get_user_role(user_id):
+    profile = await get_user_profile(user_id)
+    if profile:
+        return profile.role
+    else:
+        return None
+
+
+async def get_user_family_id(user_id):
+    profile = await get_user_profile(user_id)
+    if profile:
+        return profile.family_id
+    else:
+        return None
+
+
+set_user_language = _run_in_db_thread(db_functions.set_user_language)
+mark_user_returning = _run_in_db_thread(db_functions.mark_user_returning)
+create_family = _run_in_db_thread(db_functions.create_family)
+join_family = _run_in_db_thread(db_functions.join_family)
+save_income = _run_in_db_thread(db_functions.save_income)
+save_expense = _run_in_db_thread(db_functions.save_expense)
+approve_transaction = _run_in_db_thread(db_functions.approve_transaction)
+reject_transaction = _run_in_db_thread(db_functions.reject_transaction)
+get_family_head_id = _run_in_db_thread(db_functions.get_family_head_id)
+set_family_budget = _run_in_db_thread(db_functions.set_family_budget)
+get_data_version = _run_in_db_thread(report_data.get_data_version)
+insert_transactions = _run_in_db_thread(db_functions.insert_transactions)
+
+# Limits the imports running at once, created on first use in the event loop
+_import_slots = None
+
+
+async def import_transactions(user_id, family_id, language, file_name, content):
+    # At most IMPORT_CONCURRENCY files at once; the others wait their turn
+    global _import_slots
+    if _import_slots is None:
+        _import_slots = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    async with _import_slots:
+        return await transaction_import.import_transactions(
+            user_id, family_id, language, file_name, content, insert_transactions
+        )
@@ -0,0 +1,112 @@
+# benchmarks/db_stress.py
+#
+# Runs N writer threads (save_income/save_expense) and M report readers
+# (create_text_report) against one database file and prints p50/p99 latency.
+#
+#   python benchmarks/db_stress.py --writers 8 --readers 2 --seconds 10
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def writer(user_id, deadline, latencies, errors):
+    from db_functions import save_income, save_expense
+    rnd = random.Random(user_id)
+    while time.perf_counter() < deadline:
+        kind = rnd.choice(['income', 'expense'])
+        user_data = {
+            f'{kind}_amount': round(rnd.uniform(1, 1000), 2),
+            f'{kind}_currency': rnd.choice(['USD', 'UZS']),
+            f'{kind}_category': 'Boshqalar',
+            f'{kind}_comment': 'stress',
+        }
+        started = time.perf_counter()
+        try:
+            if kind == 'income':
+                save_income(user_id, user_data)
+            else:
+                save_expense(user_id, user_data)
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def reader(user_ids, deadline, latencies, errors):
+    from report_generation import create_text_report
+    rnd = random.Random()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            create_text_report(rnd.choice(user_ids), rnd.choice(['weekly', 'monthly']), 'uz')
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def run_group(name, target, count, args_for):
+    latencies, errors, threads = [], [], []
+    for i in range(count):
+        thread = threading.Thread(target=target, args=args_for(i) + (latencies, errors), daemon=True)
+        threads.append(thread)
+    return name, threads, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite write/report stress benchmark')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--db', help='database file (default: a fresh temporary file)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'stress.db')
+    os.environ['BOT_DB_PATH'] = db_path
+    from db_functions import init_db, set_user_language
+    init_db()
+    user_ids = list(range(1, args.writers + 1))
+    for user_id in user_ids:
+        set_user_language(user_id, 'uz')
+
+    deadline = time.perf_counter() + args.seconds
+    groups = [
+        run_group('write', writer, args.writers, lambda i: (user_ids[i], deadline)),
+        run_group('report', reader, args.readers, lambda i: (user_ids, deadline)),
+    ]
+    for _, threads, _, _ in groups:
+        for thread in threads:
+            thread.start()
+    for _, threads, _, _ in groups:
+        for thread in threads:
+            thread.join()
+
+    print(f"database: {db_path}")
+    for name, _, latencies, errors in groups:
+        print(
+            f"{name:>6}: {len(latencies)} ops, {len(latencies) / args.seconds:.1f} ops/s, "
+            f"p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+            f"p99 {percentile(latencies, 99) * 1000:.2f} ms, "
+            f"errors {len(errors)}"
+        )
+        for error in sorted(set(errors))[:3]:
+            print(f"        {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# benchmarks/dispatch_load.py
+#
+# Feeds thousands of synthetic updates straight into the application: every
+# chat goes through a full "add income" conversation (/start, language,
+# menu, amount, currency, category, comment), interleaved with all other
+# chats. Runs once per BOT_CONCURRENT_UPDATES value, each in its own process
+# against a fake Bot API, and prints updates/s plus whether every
+# conversation ended with exactly the income it entered (i.e. per-chat order
+# held). Telegram's flood limits are lifted unless --flood-limits is given,
+# the fake API has none and at 30 calls/s they would be all that's measured.
+#
+#   python benchmarks/dispatch_load.py --chats 500 --concurrency 1 8 256 --api-latency 20
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import TOKEN, FakeBotApi, callback_update, command_update
+
+
+def conversation(user_id):
+    # (kind, payload) steps of one income entry, amount = user_id
+    return [
+        ('message', '/start'),
+        ('callback', 'lang_uz'),
+        ('message', '⬇️Kirim'),
+        ('message', str(user_id)),
+        ('callback', 'USD'),
+        ('callback', 'Boshqalar'),
+        ('message', 'load test'),
+    ]
+
+
+def build_updates(chats):
+    # Step i of every chat before step i + 1 of any chat
+    steps = {user_id: conversation(user_id) for user_id in range(1, chats + 1)}
+    updates = []
+    for i in range(len(steps[1])):
+        for user_id, chat_steps in steps.items():
+            kind, payload = chat_steps[i]
+            update_id = len(updates) + 1
+            if kind == 'message':
+                updates.append(command_update(update_id, user_id, payload))
+            else:
+                updates.append(callback_update(update_id, user_id, payload))
+    return updates
+
+
+async def process(application, updates):
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    for update in updates:
+        await application.update_queue.put(update)
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+    return elapsed
+
+
+def run_load(chats, concurrency, api_latency, flood_limits):
+    api = FakeBotApi(latency=api_latency / 1000)
+    os.environ.update(
+        BOT_TOKEN=TOKEN,
+        BOT_API_URL=api.base_url,
+        BOT_DB_PATH=os.path.join(tempfile.mkdtemp(), 'load.db'),
+        BOT_CONCURRENT_UPDATES=str(concurrency),
+    )
+    if not flood_limits:
+        os.environ.update(BOT_OUTBOUND_RATE='1000000', BOT_OUTBOUND_CHAT_BURST='1000000')
+    sys.path.insert(0, ROOT)
+    warnings.filterwarnings('ignore', message=".*per_message=False")
+    from telegram import Update
+    from chat_dispatcher import create_application
+    from db_functions import get_connection, init_db
+    from main import register_handlers
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db()
+    application = create_application()
+    register_handlers(application)
+    updates = [Update.de_json(update, application.bot) for update in build_updates(chats)]
+    elapsed = asyncio.run(process(application, updates))
+
+    rows = get_connection().execute(
+        "SELECT user_id, amount FROM incomes WHERE category = 'Boshqalar' AND comment = 'load test'"
+    ).fetchall()
+    correct = sum(1 for user_id, amount in rows if amount == user_id)
+    api_calls = sum(api.counts.values())
+    api.close()
+    print(
+        f'concurrency {concurrency:>4}: {len(updates)} updates in {elapsed:.2f}s, {len(updates) / elapsed:.0f} updates/s, '
+        f'{api_calls / len(updates):.2f} Bot API calls/update, '
+        f'conversations completed {correct}/{chats}, extra rows {len(rows) - correct}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dispatcher load test')
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 256], help='BOT_CONCURRENT_UPDATES values')
+    parser.add_argument('--api-latency', type=float, default=20, help='milliseconds added to every Bot API call')
+    parser.add_argument('--flood-limits', action='store_true', help="keep Telegram's outbound rate limits")
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_load(args.chats, args.run, args.api_latency, args.flood_limits)
+        return
+
+    for concurrency in args.concurrency:
+        command = [sys.executable, __file__, '--run', str(concurrency), '--chats', str(args.chats), '--api-latency', str(args.api_latency)]
+        if args.flood_limits:
+            command.append('--flood-limits')
+        subprocess.run(command, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# benchmarks/excel_export.py
+#
+# Exports a weekly Excel report over N synthetic transactions with the
+# streaming exporter (report_generation.create_report) and with the previous
+# DataFrame + pd.ExcelWriter implementation, each in its own process, and
+# prints wall time and peak RSS.
+#
+#   python benchmarks/excel_export.py --rows 1000000
+
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER_ID = 1
+
+
+def seed(db_path, rows):
+    os.environ['BOT_DB_PATH'] = db_path
+    from db_functions import init_db, rebuild_rollups, set_user_language, transaction
+    init_db()
+    set_user_language(USER_ID, 'uz')
+    rnd = random.Random(0)
+    start = datetime.now() - timedelta(days=6)
+    step = timedelta(days=6) / rows
+    batch = []
+    with transaction() as c:
+        for i in range(rows):
+            batch.append((
+                USER_ID, start + step * i, round(rnd.uniform(1, 1000), 2),
+                rnd.choice(['USD', 'UZS']), 'Boshqalar', f'benchmark row {i}',
+            ))
+            if len(batch) == 10000 or i == rows - 1:
+                table = 'incomes' if rnd.random() < 0.3 else 'expenses'
+                c.executemany(
+                    f'INSERT INTO {table} (user_id, date, amount, currency, category, comment) VALUES (?, ?, ?, ?, ?, ?)',
+                    batch,
+                )
+                batch = []
+    rebuild_rollups()
+
+
+def legacy_export(file_name):
+    # The pre-streaming implementation: whole result sets in DataFrames
+    import pandas as pd
+    from db_functions import get_connection
+    conn = get_connection()
+    since = datetime.now() - timedelta(days=7)
+    frames = {}
+    for table in ('incomes', 'expenses'):
+        df = pd.read_sql_query(f'SELECT * FROM {table} WHERE user_id = ? AND approved = 1', conn, params=(USER_ID,))
+        df['date'] = pd.to_datetime(df['date'])
+        df = df[df['date'] >= since]
+        df = df.drop(columns=['id', 'user_id', 'family_id', 'approved'])
+        frames[table] = df
+    income_total = frames['incomes'].groupby('currency')['amount'].sum().reset_index()
+    expense_total = frames['expenses'].groupby('currency')['amount'].sum().reset_index()
+    total_df = pd.merge(income_total, expense_total, on='currency', how='outer', suffixes=('_in', '_out')).fillna(0)
+    total_df['balance'] = total_df['amount_in'] - total_df['amount_out']
+    with pd.ExcelWriter(file_name, engine='openpyxl') as writer:
+        total_df.to_excel(writer, sheet_name='Umumiy Hisobot', index=False)
+        frames['incomes'].to_excel(writer, sheet_name='Kirimlar', index=False)
+        frames['expenses'].to_excel(writer, sheet_name='Chiqimlar', index=False)
+    return file_name
+
+
+def run_export(mode, db_path):
+    os.environ['BOT_DB_PATH'] = db_path
+    os.chdir(os.path.dirname(db_path))
+    # Import cost is not part of the measurement
+    import pandas  # noqa: F401
+    import report_generation
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if mode == 'streaming':
+        buffer, _ = report_generation.create_report(USER_ID, 'weekly', 'uz')
+        elapsed = time.perf_counter() - started
+        size = buffer.seek(0, os.SEEK_END)
+        buffer.close()
+    else:
+        file_name = legacy_export('legacy.xlsx')
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(file_name)
+        os.remove(file_name)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    print(f"{mode:>9}: {elapsed:7.1f} s, peak RSS {peak / 1024:7.0f} MiB "
+          f"(+{(peak - baseline) / 1024:.0f} MiB over imports), file {size / 2 ** 20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Excel report export benchmark')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--mode', choices=['streaming', 'legacy'], help='run a single export (used internally)')
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_export(args.mode, args.db)
+        return
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'export.db')
+    started = time.perf_counter()
+    seed(db_path, args.rows)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f} s ({db_path})")
+    for mode in ('streaming', 'legacy'):
+        subprocess.run([sys.executable, __file__, '--mode', mode, '--db', db_path], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# benchmarks/fake_bot_api.py
+#
+# A local stand-in for the Bot API, used by the benchmarks to run main.py
+# without Telegram. It answers getMe, getUpdates (with queued updates),
+# setWebhook and the send*/edit*/delete* calls handlers make, and counts them.
+# latency adds a delay to every call, like the round trip to Telegram.
+
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+TOKEN = '123456:benchmark'
+
+
+def callback_update(update_id, user_id, data):
+    # A press of an inline button with callback data in user_id's private chat
+    query = {
+        'id': str(update_id),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+        'message': {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}},
+        'chat_instance': str(user_id),
+        'data': data,
+    }
+    return {'update_id': update_id, 'callback_query': query}
+
+
+def command_update(update_id, user_id, text='/start'):
+    # A private-chat message from user_id, as Telegram would deliver it
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        method = self.path.rsplit('/', 1)[-1]
+        self.server.record(method)
+        if self.server.latency and method != 'getUpdates':
+            # Round trip to the real Bot API
+            time.sleep(self.server.latency)
+        if method == 'getMe':
+            result = {'id': 2, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'getUpdates':
+            result = self.server.next_updates()
+        elif method.startswith(('send', 'edit')):
+            chat_id = self.server.chat_id(self.headers.get('Content-Type', ''), body)
+            result = {'message_id': 1000, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}, 'text': ''}
+        else:
+            result = True
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    daemon_threads = True
+    # The bot opens its connections all at once; the default backlog of 5
+    # drops SYNs and stalls connects for a second
+    request_queue_size = 1024
+
+    def __init__(self, updates=(), latency=0.0):
+        super().__init__(('127.0.0.1', 0), FakeBotApiHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.first_call = {}
+        self.counts = Counter()
+        self.updates = list(updates)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/bot'
+
+    def record(self, method):
+        with self.lock:
+            self.first_call.setdefault(method, time.perf_counter())
+            self.counts[method] += 1
+
+    def chat_id(self, content_type, body):
+        # Parameters come form-encoded, or as multipart when a file is sent
+        try:
+            if content_type.startswith('application/x-www-form-urlencoded'):
+                return int(parse_qs(body.decode())['chat_id'][0])
+            return int(json.loads(body).get('chat_id', 0))
+        except (ValueError, KeyError):
+            return 0
+
+    def next_updates(self):
+        with self.lock:
+            updates, self.updates = self.updates, []
+        if not updates:
+            # Long poll with nothing to deliver
+            time.sleep(0.5)
+        return updates
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
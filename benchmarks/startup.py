@@ -0,0 +1,73 @@
+# benchmarks/startup.py
+#
+# Starts `python main.py` against a fake Bot API server that delivers one
+# /start update, and prints the time until the bot has started polling and
+# until it answers that update. --preload imports the given modules before
+# main.py, e.g. to see what eagerly loading the reporting stack would cost.
+#
+#   python benchmarks/startup.py --runs 5
+#   python benchmarks/startup.py --runs 5 --preload report_generation
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import TOKEN, FakeBotApi, command_update
+
+
+def run_once(preload):
+    server = FakeBotApi([command_update(1, 1)])
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            BOT_TOKEN=TOKEN,
+            BOT_API_URL=server.base_url,
+            BOT_DB_PATH=os.path.join(tmp, 'bot.db'),
+            BOT_REPORT_WARMUP='0',
+        )
+        command = [sys.executable, 'main.py']
+        if preload:
+            code = f"import {', '.join(preload)}, runpy; runpy.run_path('main.py', run_name='__main__')"
+            command = [sys.executable, '-c', code]
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = started + 60
+            while 'sendMessage' not in server.first_call and time.perf_counter() < deadline:
+                if process.poll() is not None:
+                    raise RuntimeError(f'main.py exited with code {process.returncode}')
+                time.sleep(0.005)
+        finally:
+            process.terminate()
+            process.wait()
+            server.close()
+    if 'sendMessage' not in server.first_call:
+        raise RuntimeError('no reply to /start within 60s')
+    return server.first_call['getUpdates'] - started, server.first_call['sendMessage'] - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--preload', nargs='*', default=[], help='modules to import before main.py')
+    args = parser.parse_args()
+
+    polling, answered = [], []
+    for _ in range(args.runs):
+        first_poll, first_reply = run_once(args.preload)
+        polling.append(first_poll)
+        answered.append(first_reply)
+    print(f'preload: {", ".join(args.preload) or "-"}')
+    print(f'first getUpdates: median {statistics.median(polling):.3f}s  max {max(polling):.3f}s')
+    print(f'first update handled: median {statistics.median(answered):.3f}s  max {max(answered):.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# benchmarks/webhook_replay.py
+#
+# Runs main.py in webhook mode against a fake Bot API, posts Update JSON to
+# the webhook from several connections and prints how fast updates are
+# accepted and handled, then stops the bot with SIGTERM and times the drain.
+# Updates come from a file of recorded Update objects (one JSON per line) or
+# are synthetic /start messages from distinct users.
+#
+#   python benchmarks/webhook_replay.py --count 2000 --concurrency 8
+#   python benchmarks/webhook_replay.py --updates recorded.jsonl
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db_stress import percentile
+from fake_bot_api import TOKEN, FakeBotApi, command_update
+
+SECRET = 'replay-secret'
+PATH = '/telegram'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def load_updates(args):
+    if args.updates:
+        with open(args.updates, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    return [command_update(i + 1, 1000 + i) for i in range(args.count)]
+
+
+def wait_ready(port, process, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'main.py exited with code {process.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/readyz')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError('webhook not ready')
+
+
+def post(conn, body, secret=SECRET):
+    conn.request('POST', PATH, body, {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret})
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def sender(port, bodies, latencies, statuses):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for body in bodies:
+        started = time.perf_counter()
+        status = post(conn, body)
+        latencies.append(time.perf_counter() - started)
+        statuses.append(status)
+    conn.close()
+
+
+def wait_handled(api, expected, timeout=120):
+    # Synthetic /starts get exactly one reply each; recorded updates are
+    # considered handled once the bot has made no Bot API calls for a second
+    deadline = time.perf_counter() + timeout
+    last_total, last_change = -1, time.perf_counter()
+    while time.perf_counter() < deadline:
+        total = sum(api.counts.values())
+        if expected is not None and api.counts['sendMessage'] >= expected:
+            return time.perf_counter()
+        if total != last_total:
+            last_total, last_change = total, time.perf_counter()
+        elif expected is None and time.perf_counter() - last_change > 1:
+            return last_change
+        time.sleep(0.01)
+    raise RuntimeError('updates not handled in time')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', help='file with one recorded Update JSON per line')
+    parser.add_argument('--count', type=int, default=2000, help='synthetic /start updates to send')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    updates = load_updates(args)
+    bodies = [json.dumps(update).encode() for update in updates]
+    api = FakeBotApi()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            BOT_TOKEN=TOKEN,
+            BOT_API_URL=api.base_url,
+            BOT_DB_PATH=os.path.join(tmp, 'bot.db'),
+            BOT_REPORT_WARMUP='0',
+            BOT_WEBHOOK_URL=f'http://127.0.0.1:{port}',
+            BOT_WEBHOOK_LISTEN='127.0.0.1',
+            BOT_WEBHOOK_PORT=str(port),
+            BOT_WEBHOOK_PATH=PATH,
+            BOT_WEBHOOK_SECRET=SECRET,
+        )
+        process = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(port, process)
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            wrong_secret = post(conn, bodies[0], secret='wrong')
+            conn.close()
+
+            latencies, statuses = [], []
+            threads = [
+                threading.Thread(target=sender, args=(port, bodies[i::args.concurrency], latencies, statuses))
+                for i in range(args.concurrency)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            posted = time.perf_counter()
+            handled = wait_handled(api, None if args.updates else len(bodies))
+
+            stop_started = time.perf_counter()
+            process.send_signal(signal.SIGTERM)
+            exit_code = process.wait(timeout=120)
+            stopped = time.perf_counter()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            api.close()
+
+    print(f'updates: {len(bodies)}, concurrency: {args.concurrency}, wrong secret -> {wrong_secret}')
+    print(f'responses: {dict(sorted(Counter(statuses).items()))}')
+    print(f'accepted: {len(bodies) / (posted - started):.0f} updates/s, '
+          f'POST p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms')
+    print(f'handled: {len(bodies) / (handled - started):.0f} updates/s ({handled - started:.2f}s)')
+    print(f'shutdown: {stopped - stop_started:.2f}s, exit code {exit_code}')
+
+
+if __name__ == '__main__':
+    main()
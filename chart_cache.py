@@ -0,0 +1,46 @@
+# chart_cache.py
+
+import threading
+from collections import OrderedDict
+from constants import CHART_CACHE_SIZE
+
+# (scope, graph_type, language) -> (data version, PNG bytes), least recently used first
+_lock = threading.Lock()
+_charts = OrderedDict()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def get_chart(key, version):
+    # PNG bytes rendered from this version of the scope's data, or None
+    with _lock:
+        entry = _charts.get(key)
+        if entry is None or entry[0] != version:
+            _stats['misses'] += 1
+            return None
+        _charts.move_to_end(key)
+        _stats['hits'] += 1
+        return entry[1]
+
+
+def store_chart(key, version, png):
+    with _lock:
+        entry = _charts.get(key)
+        if entry is not None and entry[0] > version:
+            # A newer render got here first
+            return
+        _charts[key] = (version, png)
+        _charts.move_to_end(key)
+        while len(_charts) > CHART_CACHE_SIZE:
+            _charts.popitem(last=False)
+
+
+def invalidate_scope(scope):
+    # Drop every chart of a scope whose data just changed
+    with _lock:
+        for key in [key for key in _charts if key[0] == scope]:
+            del _charts[key]
+
+
+def get_cache_stats():
+    with _lock:
+        return dict(_stats, size=len(_charts))
@@ -0,0 +1,99 @@
+# chat_dispatcher.py
+
+import asyncio
+from telegram import Update
+from telegram.ext import ApplicationBuilder, BaseUpdateProcessor
+from telegram.request import HTTPXRequest
+from outbound import OutboundLimiter
+from persistence import SQLitePersistence
+from constants import TOKEN, BOT_API_URL, BOT_API_FILE_URL, CONCURRENT_UPDATES, API_CONNECTIONS
+
+# The base class's limit on concurrent updates, see ChatOrderedUpdateProcessor
+UNLIMITED_UPDATES = 2 ** 31 - 1
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Handles up to max_concurrent_updates updates at once on the event loop,
+    # but all updates of a user one at a time and in order (conversation
+    # state and user_data stay consistent). asyncio locks are fair, so a
+    # user's updates get the lock in the order they were received. An update
+    # takes one of the max_concurrent_updates slots only once it holds its
+    # user's lock, so a user sending a burst doesn't stall everyone else.
+    # The base class takes its own slot before do_process_update, so it gets
+    # a limit that is never reached (and reports it as max_concurrent_updates)
+    # and the real one is applied in there.
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(UNLIMITED_UPDATES)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        self._limit = max_concurrent_updates
+        # Created in initialize(), on the application's event loop
+        self._slots = None
+        # key -> [lock, updates holding or waiting for it]
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            # Idle users don't keep a lock around
+            if not entry[1]:
+                del self._locks[key]
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return update.update_id
+
+    async def initialize(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._limit)
+
+    async def shutdown(self):
+        pass
+
+
+class QueuedHTTPXRequest(HTTPXRequest):
+    # httpcore's pool does work quadratic in its size for every request that
+    # waits for a connection, which makes hundreds of concurrent updates CPU
+    # bound. Requests wait on a semaphore instead, so the pool never queues.
+
+    def __init__(self, connection_pool_size, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self._slots = asyncio.Semaphore(connection_pool_size)
+
+    async def do_request(self, *args, **kwargs):
+        async with self._slots:
+            return await super().do_request(*args, **kwargs)
+
+
+def create_application(post_init=None, post_shutdown=None):
+    return (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(BOT_API_URL)
+        .base_file_url(BOT_API_FILE_URL)
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .request(QueuedHTTPXRequest(API_CONNECTIONS))
+        .rate_limiter(OutboundLimiter())
+        .persistence(SQLitePersistence())
+        # Delayed deletions run as tasks, nothing needs APScheduler
+        .job_queue(None)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
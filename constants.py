@@ -1,7 +1,53 @@
 # constants.py
 
+import os
+
 # Telegram bot token from BotFather
-TOKEN = 'YOUR_BOT_TOKEN'
+TOKEN = os.environ.get('BOT_TOKEN', 'YOUR_BOT_TOKEN')
+
+# Bot API endpoint, e.g. a local Bot API server
+BOT_API_URL = os.environ.get('BOT_API_URL', 'https://api.telegram.org/bot')
+# Where files sent to the bot are downloaded from
+BOT_API_FILE_URL = os.environ.get('BOT_API_FILE_URL', 'https://api.telegram.org/file/bot')
+
+# Updates handled concurrently on the event loop (each user's updates are
+# still handled one at a time and in order), and threads running the
+# blocking SQLite calls for them
+CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', 256))
+DB_THREADS = int(os.environ.get('BOT_DB_THREADS', 4))
+
+# Keep-alive connections to the Bot API, i.e. Bot API calls in flight at once;
+# more connections make every request slower to schedule in httpx
+API_CONNECTIONS = int(os.environ.get('BOT_API_CONNECTIONS', 32))
+
+# Telegram's flood limits for sending: messages per second overall, and per
+# chat a short burst, then one per second (20 per minute in groups)
+OUTBOUND_RATE = float(os.environ.get('BOT_OUTBOUND_RATE', 30))
+OUTBOUND_CHAT_BURST = int(os.environ.get('BOT_OUTBOUND_CHAT_BURST', 3))
+OUTBOUND_CHAT_RATE = 1.0
+OUTBOUND_GROUP_RATE = 20 / 60
+
+# Seconds between writes of changed user_data and conversation states,
+# they are also written when the bot stops
+STATE_FLUSH_INTERVAL = float(os.environ.get('BOT_STATE_FLUSH_INTERVAL', 30))
+
+# Seconds between logs of the report queue, cache and outbound counters; 0
+# logs them only on shutdown
+METRICS_LOG_INTERVAL = float(os.environ.get('BOT_METRICS_LOG_INTERVAL', 300))
+
+# Seconds a chat's message deletions are collected for one deleteMessages call
+DELETE_BATCH_WINDOW = float(os.environ.get('BOT_DELETE_BATCH_WINDOW', 0.5))
+
+# Webhook mode: set BOT_WEBHOOK_URL to the public https://host[:port] Telegram
+# should post updates to (plus BOT_WEBHOOK_PATH); empty means long polling
+WEBHOOK_URL = os.environ.get('BOT_WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_LISTEN = os.environ.get('BOT_WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('BOT_WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = os.environ.get('BOT_WEBHOOK_PATH', '/telegram')
+# Checked against X-Telegram-Bot-Api-Secret-Token; generated when empty
+WEBHOOK_SECRET = os.environ.get('BOT_WEBHOOK_SECRET', '')
+# Seconds to finish already received updates on shutdown
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get('BOT_WEBHOOK_DRAIN_TIMEOUT', 30))
 
 # States for ConversationHandler
 (
@@ -27,3 +73,50 @@ TOKEN = 'YOUR_BOT_TOKEN'
 
 # Supported currencies
 CURRENCIES = ['USD', 'UZS']
+
+# Texts missing in a language, and users without one, use this language
+DEFAULT_LANGUAGE = 'uz'
+
+# SQLite database file
+DB_PATH = os.environ.get('BOT_DB_PATH', 'bot_database.db')
+
+# Seconds a connection waits on a locked database before giving up
+DB_BUSY_TIMEOUT = float(os.environ.get('BOT_DB_BUSY_TIMEOUT', 5))
+
+# Extra attempts (with exponential backoff) to start a write transaction
+DB_LOCK_RETRIES = 5
+DB_LOCK_BACKOFF = 0.05
+
+# Report rendering worker processes, queued renders allowed across all
+# users, and renders one user may have in flight at once
+REPORT_WORKERS = int(os.environ.get('BOT_REPORT_WORKERS', 2))
+REPORT_QUEUE_SIZE = int(os.environ.get('BOT_REPORT_QUEUE_SIZE', 16))
+REPORT_USER_LIMIT = 1
+
+# Start the report workers and load matplotlib/openpyxl in them once the bot
+# is receiving updates (polling or webhook), instead of on the first report
+# request
+REPORT_WARMUP = os.environ.get('BOT_REPORT_WARMUP', '1') == '1'
+
+# Rendered charts kept in memory, keyed by (scope, graph type, language)
+CHART_CACHE_SIZE = int(os.environ.get('BOT_CHART_CACHE_SIZE', 128))
+
+# User profiles (language, role, family, budget) cached per process, and
+# seconds before a cached profile is read again
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = float(os.environ.get('BOT_PROFILE_CACHE_TTL', 300))
+
+# What happens when a family member's expense is more than their remaining
+# budget: 'off' (allowed), 'flag' (saved, the head is warned when asked to
+# approve) or 'reject' (not saved, and not approvable once over budget).
+# Members without a budget (the head never set one) have no limit.
+# Approved expenses are always deducted from the member's budget, if any.
+BUDGET_ENFORCEMENT = os.environ.get('BOT_BUDGET_ENFORCEMENT', 'off')
+
+# Imported transactions are written this many rows per transaction, and
+# files larger than IMPORT_MAX_FILE_SIZE (Telegram's download limit) are refused
+IMPORT_CHUNK_SIZE = int(os.environ.get('BOT_IMPORT_CHUNK_SIZE', 5000))
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Files imported at once; more wait, so imports never hold every database
+# thread
+IMPORT_CONCURRENCY = int(os.environ.get('BOT_IMPORT_CONCURRENCY', 2))
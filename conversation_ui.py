@@ -0,0 +1,53 @@
+# conversation_ui.py
+
+import logging
+from telegram import ReplyKeyboardMarkup
+from telegram.error import BadRequest
+from utilities import delete_previous_bot_message, delete_message_later
+
+# Only messages without a reply keyboard can be edited, so a flow shows each
+# step in one such message as long as it is the last thing the bot sent.
+# 'last_bot_message_id' keeps pointing at the message on screen, so the
+# cleanup in cancel() and the menus works as before.
+
+
+def _editable_message_id(context):
+    message_id = context.user_data.get('flow_message_id')
+    if message_id is not None and message_id == context.user_data.get('last_bot_message_id'):
+        return message_id
+    return None
+
+
+async def render_step(update, context, text, reply_markup=None):
+    # Shows a step of the flow: edits the flow's message in place when it
+    # can, otherwise replaces the last bot message with a new one
+    chat_id = update.effective_chat.id
+    message_id = _editable_message_id(context)
+    if message_id is not None and not isinstance(reply_markup, ReplyKeyboardMarkup):
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup
+            )
+            return
+        except BadRequest as e:
+            if 'not modified' in str(e):
+                return
+            # Deleted by the user or too old to edit, send a new one
+            logging.info(f"Could not edit message {message_id}, sending a new one: {e}")
+    delete_previous_bot_message(update, context)
+    message = await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    context.user_data['last_bot_message_id'] = message.message_id
+    if isinstance(reply_markup, ReplyKeyboardMarkup):
+        context.user_data.pop('flow_message_id', None)
+    else:
+        context.user_data['flow_message_id'] = message.message_id
+
+
+async def finish_flow(update, context, text, delay=3):
+    # Shows the flow's outcome in its message and deletes it after delay seconds
+    chat_id = update.effective_chat.id
+    await render_step(update, context, text)
+    # Without a keyboard the outcome is always in the flow's message
+    message_id = context.user_data.pop('flow_message_id')
+    del context.user_data['last_bot_message_id']
+    delete_message_later(context, chat_id, message_id, delay)
@@ -1,13 +1,129 @@
 # db_functions.py
 
+import json
+import logging
+import math
+import random
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from typing import NamedTuple
+from cachetools import TTLCache
+from constants import (
+    DB_PATH,
+    DB_BUSY_TIMEOUT,
+    DB_LOCK_RETRIES,
+    DB_LOCK_BACKOFF,
+    PROFILE_CACHE_SIZE,
+    PROFILE_CACHE_TTL,
+    BUDGET_ENFORCEMENT,
+)
 from utilities import sanitize_comment
 
-def init_db():
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    # Create tables
+# One long-lived connection per worker thread
+_local = threading.local()
+
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # Autocommit mode: plain reads don't hold a transaction open,
+        # writes are grouped explicitly with transaction()
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+        # WAL (set in init_db) only needs fsync at checkpoints with NORMAL
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA cache_size = -8000')
+        conn.create_aggregate('exact_sum', -1, ExactSum)
+        conn.create_aggregate('exact_sum_remainder', 1, ExactSumRemainder)
+        conn.create_function('two_sum_remainder', 2, two_sum_remainder, deterministic=True)
+        _local.conn = conn
+    return conn
+
+
+class ExactSum:
+    # Correctly rounded sum (math.fsum) of all non-NULL arguments. The result
+    # doesn't depend on row order, so totals read from daily_totals equal the
+    # same totals summed over the transactions.
+    def __init__(self):
+        self.values = []
+
+    def step(self, *values):
+        self.values.extend(value for value in values if value is not None)
+
+    def finalize(self):
+        return math.fsum(self.values)
+
+
+class ExactSumRemainder(ExactSum):
+    # What ExactSum rounded away
+    def finalize(self):
+        total = math.fsum(self.values)
+        return math.fsum(self.values + [-total])
+
+
+def two_sum_remainder(a, b):
+    # Exact rounding error of a + b (Knuth's TwoSum)
+    total = a + b
+    b_part = total - a
+    return (a - (total - b_part)) + (b - b_part)
+
+
+def is_locked_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def _begin_immediate(conn):
+    # Take the write lock up front so the transaction can't fail halfway
+    # through; retry with backoff if another writer holds it past the busy timeout
+    delay = DB_LOCK_BACKOFF
+    for attempt in range(DB_LOCK_RETRIES + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if not is_locked_error(e) or attempt == DB_LOCK_RETRIES:
+                raise
+            logging.warning(f"Database is locked, retrying in {delay:.2f}s: {e}")
+            time.sleep(delay * (1 + random.random()))
+            delay *= 2
+
+
+@contextmanager
+def transaction():
+    conn = get_connection()
+    if conn.in_transaction:
+        # Nested call, the outermost block commits
+        yield conn.cursor()
+        return
+    _begin_immediate(conn)
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+@contextmanager
+def read_snapshot():
+    # Several SELECTs see one consistent view without taking the write lock
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
+    conn.execute('BEGIN')
+    try:
+        yield conn.cursor()
+    finally:
+        conn.commit()
+
+
+def _create_base_schema(c):
     c.execute(
         '''CREATE TABLE IF NOT EXISTS users (
                         user_id INTEGER PRIMARY KEY,
@@ -53,212 +169,513 @@ def init_db():
                         head_id INTEGER
                     )'''
     )
-    conn.commit()
-    conn.close()
-    # Ensure columns exist
-    add_column_if_not_exists('users', 'family_id', 'INTEGER')
-    add_column_if_not_exists('users', 'role', 'TEXT')
-    add_column_if_not_exists('users', 'budget', 'REAL DEFAULT 0')
-    add_column_if_not_exists('incomes', 'family_id', 'INTEGER')
-    add_column_if_not_exists('expenses', 'family_id', 'INTEGER')
-    add_column_if_not_exists('incomes', 'approved', 'BOOLEAN DEFAULT 1')
-    add_column_if_not_exists('expenses', 'approved', 'BOOLEAN DEFAULT 1')
-
-
-def add_column_if_not_exists(table_name, column_name, column_definition):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
+    # Databases created before these columns existed
+    add_column_if_not_exists(c, 'users', 'family_id', 'INTEGER')
+    add_column_if_not_exists(c, 'users', 'role', 'TEXT')
+    add_column_if_not_exists(c, 'users', 'budget', 'REAL DEFAULT 0')
+    add_column_if_not_exists(c, 'incomes', 'family_id', 'INTEGER')
+    add_column_if_not_exists(c, 'expenses', 'family_id', 'INTEGER')
+    add_column_if_not_exists(c, 'incomes', 'approved', 'BOOLEAN DEFAULT 1')
+    add_column_if_not_exists(c, 'expenses', 'approved', 'BOOLEAN DEFAULT 1')
+
+
+def _create_report_indexes(c):
+    # Per-user/per-family report queries and family member lookups
+    c.execute('CREATE INDEX IF NOT EXISTS idx_incomes_user ON incomes (user_id, approved, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_incomes_family ON incomes (family_id, approved, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_expenses_user ON expenses (user_id, approved, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_expenses_family ON expenses (family_id, approved, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_family ON users (family_id, role)')
+
+
+def _create_daily_totals(c):
+    # Approved amounts per day, kept in step with incomes/expenses so reports
+    # read a few rollup rows instead of every transaction
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS daily_totals (
+                        scope_type TEXT NOT NULL,
+                        scope_id INTEGER NOT NULL,
+                        day TEXT NOT NULL,
+                        kind INTEGER NOT NULL,
+                        currency TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        total REAL NOT NULL,
+                        remainder REAL NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (scope_type, scope_id, day, kind, currency, category)
+                    ) WITHOUT ROWID'''
+    )
+    _fill_daily_totals(c)
+
+
+def _create_scope_versions(c):
+    # Bumped whenever a scope's daily_totals change, so rendered reports can be
+    # cached under (scope, version) and go stale on their own
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS scope_versions (
+                        scope_type TEXT NOT NULL,
+                        scope_id INTEGER NOT NULL,
+                        version INTEGER NOT NULL,
+                        PRIMARY KEY (scope_type, scope_id)
+                    ) WITHOUT ROWID'''
+    )
+
+
+def _create_bot_state(c):
+    # user_data and conversation states of the bot, so a restart doesn't
+    # drop users out of half-finished flows
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS user_state (
+                        user_id INTEGER PRIMARY KEY,
+                        data TEXT NOT NULL
+                    )'''
+    )
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS conversation_states (
+                        name TEXT NOT NULL,
+                        conversation_key TEXT NOT NULL,
+                        state INTEGER NOT NULL,
+                        PRIMARY KEY (name, conversation_key)
+                    ) WITHOUT ROWID'''
+    )
+
+
+def _unset_zero_budgets(c):
+    # A member's budget is NULL until the head sets one, and NULL means no
+    # limit. It used to default to 0, which can't be told apart from a budget
+    # set to (or spent down to) exactly 0; those are taken as never set.
+    c.execute('UPDATE users SET budget = NULL WHERE budget = 0')
+
+
+# Schema migrations, applied in order once per database and tracked with
+# PRAGMA user_version (migration N brings the schema to version N).
+# Never edit or reorder a released migration, append a new one instead.
+MIGRATIONS = [
+    _create_base_schema,
+    _create_report_indexes,
+    _create_daily_totals,
+    _create_scope_versions,
+    _create_bot_state,
+    _unset_zero_budgets,
+]
+
+
+def init_db():
+    # Called once at process startup, handlers never touch the schema
+    conn = get_connection()
+    # WAL lets report readers run alongside writers; the mode is stored in the file
+    conn.execute('PRAGMA journal_mode = WAL')
+    if get_schema_version() >= len(MIGRATIONS):
+        return
+    with transaction() as c:
+        apply_migrations(c)
+
+
+def get_schema_version():
+    return get_connection().execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(c):
+    # Re-read the version under the write lock, another process may have migrated
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(c)
+        c.execute(f'PRAGMA user_version = {number}')
+        logging.info(f"Applied database migration {number}: {migration.__name__}")
+
+
+def add_column_if_not_exists(c, table_name, column_name, column_definition):
     # Check if column exists
     c.execute(f"PRAGMA table_info({table_name})")
     columns = [info[1] for info in c.fetchall()]
     if column_name not in columns:
         c.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
-    conn.commit()
-    conn.close()
 
 
-def get_user_language(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
+class UserProfile(NamedTuple):
+    language: str
+    first_time: bool
+    family_id: int
+    role: str
+    # None until the family head sets one: no limit
+    budget: float
+
+
+# Profiles are read on nearly every update; keep recent ones for a short while.
+# Writers call invalidate_user_profile() after committing.
+_profile_lock = threading.Lock()
+_profiles = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+_profile_generation = 0
+_profile_stats = {'hits': 0, 'misses': 0}
+
+# get_cached_user_profile() result when the profile has to be read
+NOT_CACHED = object()
+
+
+def _load_user_profile(conn, user_id):
+    c = conn.execute(
+        'SELECT language, first_time, family_id, role, budget FROM users WHERE user_id = ?', (user_id,)
+    )
     result = c.fetchone()
-    conn.close()
     if result:
-        return result[0]
+        return UserProfile(*result)
     else:
         return None
 
 
-def set_user_language(user_id, language):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    if result:
-        # User exists, update language and set first_time to False
-        c.execute(
-            'UPDATE users SET language = ?, first_time = 0 WHERE user_id = ?', (language, user_id)
-        )
+def get_user_profile(user_id):
+    # All users columns in one query, None for unknown users
+    conn = get_connection()
+    if conn.in_transaction:
+        # Writers must see the row as it is inside their transaction
+        return _load_user_profile(conn, user_id)
+    with _profile_lock:
+        if user_id in _profiles:
+            _profile_stats['hits'] += 1
+            return _profiles[user_id]
+        _profile_stats['misses'] += 1
+        generation = _profile_generation
+    profile = _load_user_profile(conn, user_id)
+    with _profile_lock:
+        # Don't cache a row that was written while we were reading it
+        if generation == _profile_generation:
+            _profiles[user_id] = profile
+    return profile
+
+
+def get_cached_user_profile(user_id):
+    # Cache lookup only, never touches the database; NOT_CACHED on a miss
+    with _profile_lock:
+        if user_id in _profiles:
+            _profile_stats['hits'] += 1
+            return _profiles[user_id]
+    return NOT_CACHED
+
+
+def invalidate_user_profile(*user_ids):
+    global _profile_generation
+    with _profile_lock:
+        _profile_generation += 1
+        for user_id in user_ids:
+            _profiles.pop(user_id, None)
+
+
+def get_profile_cache_stats():
+    with _profile_lock:
+        return dict(_profile_stats, size=len(_profiles))
+
+
+def get_user_language(user_id):
+    profile = get_user_profile(user_id)
+    if profile:
+        return profile.language
     else:
-        # New user, insert record with first_time = 1
-        c.execute(
-            'INSERT INTO users (user_id, language, first_time) VALUES (?, ?, 1)',
-            (user_id, language),
-        )
-    conn.commit()
-    conn.close()
+        return None
+
+
+def set_user_language(user_id, language):
+    with transaction() as c:
+        c.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
+        result = c.fetchone()
+        if result:
+            # User exists, update language and set first_time to False
+            c.execute(
+                'UPDATE users SET language = ?, first_time = 0 WHERE user_id = ?', (language, user_id)
+            )
+        else:
+            # New user, insert record with first_time = 1 and no budget
+            c.execute(
+                'INSERT INTO users (user_id, language, first_time, budget) VALUES (?, ?, 1, NULL)',
+                (user_id, language),
+            )
+    invalidate_user_profile(user_id)
 
 
 def is_first_time_user(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT first_time FROM users WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return bool(result[0])
+    profile = get_user_profile(user_id)
+    if profile:
+        return bool(profile.first_time)
     else:
         return True  # Default to True if user not found
 
 
+def mark_user_returning(user_id):
+    with transaction() as c:
+        c.execute('UPDATE users SET first_time = 0 WHERE user_id = ?', (user_id,))
+    invalidate_user_profile(user_id)
+
+
 def get_user_role(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT role FROM users WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return result[0]
+    profile = get_user_profile(user_id)
+    if profile:
+        return profile.role
     else:
         return None
 
 
 def get_user_family_id(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT family_id FROM users WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return result[0]
+    profile = get_user_profile(user_id)
+    if profile:
+        return profile.family_id
     else:
         return None
 
 
 def create_family(family_name, head_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO families (family_name, head_id) VALUES (?, ?)', (family_name, head_id))
-    family_id = c.lastrowid
-    # Update user's family_id and role
-    c.execute('UPDATE users SET family_id = ?, role = ? WHERE user_id = ?', (family_id, 'head', head_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute('INSERT INTO families (family_name, head_id) VALUES (?, ?)', (family_name, head_id))
+        family_id = c.lastrowid
+        # Update user's family_id and role
+        c.execute('UPDATE users SET family_id = ?, role = ? WHERE user_id = ?', (family_id, 'head', head_id))
+    invalidate_user_profile(head_id)
     return family_id
 
 
 def join_family(user_id, family_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('UPDATE users SET family_id = ?, role = ? WHERE user_id = ?', (family_id, 'member', user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute('UPDATE users SET family_id = ?, role = ? WHERE user_id = ?', (family_id, 'member', user_id))
+    invalidate_user_profile(user_id)
+
+
+# Rollup kind for each transaction table
+ROLLUP_KINDS = {'incomes': 0, 'expenses': 1}
+
+
+def _fill_daily_totals(c):
+    # daily_totals is keyed by the same scopes reports use: every transaction
+    # counts for its user, and for its family when it has one
+    for table, kind in ROLLUP_KINDS.items():
+        for scope_column in ('user_id', 'family_id'):
+            c.execute(
+                f'''INSERT INTO daily_totals (scope_type, scope_id, day, kind, currency, category, total, remainder, count)
+                    SELECT ?, {scope_column}, date(date), ?, COALESCE(currency, ''), COALESCE(category, ''),
+                           exact_sum(amount), exact_sum_remainder(amount), COUNT(*)
+                    FROM {table}
+                    WHERE approved = 1 AND {scope_column} IS NOT NULL AND date IS NOT NULL AND amount IS NOT NULL
+                    GROUP BY {scope_column}, date(date), COALESCE(currency, ''), COALESCE(category, '')''',
+                (scope_column, kind),
+            )
+
+
+def rebuild_rollups():
+    # Recompute daily_totals from the transaction tables, e.g. after drift
+    with transaction() as c:
+        c.execute('DELETE FROM daily_totals')
+        _fill_daily_totals(c)
+        c.execute('UPDATE scope_versions SET version = version + 1')
+        count = c.execute('SELECT COUNT(*) FROM daily_totals').fetchone()[0]
+    logging.info(f"Rebuilt daily_totals: {count} rows")
+    return count
+
+
+# Adds amounts to a day's totals: (scope_type, scope_id, day, kind, currency,
+# category, amount, count)
+ROLLUP_UPSERT = '''INSERT INTO daily_totals (scope_type, scope_id, day, kind, currency, category, total, remainder, count)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, 0.0, ?)
+                   ON CONFLICT (scope_type, scope_id, day, kind, currency, category)
+                   DO UPDATE SET total = total + excluded.total,
+                                 remainder = remainder + two_sum_remainder(total, excluded.total),
+                                 count = count + excluded.count'''
+
+SCOPE_VERSION_BUMP = '''INSERT INTO scope_versions (scope_type, scope_id, version) VALUES (?, ?, 1)
+                        ON CONFLICT (scope_type, scope_id) DO UPDATE SET version = version + 1'''
+
+
+def _update_rollups(c, table, user_id, family_id, date, amount, currency, category):
+    # Add one approved transaction; approved ones are never removed. remainder
+    # collects what each addition to total rounded away, so total + remainder
+    # stays much closer to the exact sum of the day's amounts than total
+    # alone, whatever the order of updates (the additions to remainder round
+    # too). Returns the scopes whose totals changed.
+    if amount is None or date is None:
+        return []
+    key = (str(date)[:10], ROLLUP_KINDS[table], currency or '', category or '')
+    scopes = [('user_id', user_id)]
+    if family_id is not None:
+        scopes.append(('family_id', family_id))
+    for scope in scopes:
+        c.execute(ROLLUP_UPSERT, scope + key + (amount, 1))
+        c.execute(SCOPE_VERSION_BUMP, scope)
+    return scopes
+
+
+# save_expense() results
+BUDGET_OK = 'ok'
+BUDGET_FLAGGED = 'flagged'
+BUDGET_REJECTED = 'rejected'
+
+
+class SavedTransaction(NamedTuple):
+    status: str
+    transaction_id: int
+    family_id: int
+    # Saved unapproved, the family head has to be asked
+    pending: bool
 
 
 def save_income(user_id, user_data):
-    from family_budget import notify_family_head
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
+    # Returns a SavedTransaction; when it's pending the caller asks the
+    # family head to approve it (see family_budget.notify_family_head)
     current_time = datetime.now()
     # Sanitize comment input
     comment = sanitize_comment(user_data['income_comment'])
-    family_id = get_user_family_id(user_id)
-    approved = 1
-    role = get_user_role(user_id)
-    if role == 'member' and family_id is not None:
-        approved = 0  # Needs approval from head
-    c.execute(
-        'INSERT INTO incomes (user_id, date, amount, currency, category, comment, family_id, approved) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-        (
-            user_id,
-            current_time,
-            user_data['income_amount'],
-            user_data['income_currency'],
-            user_data['income_category'],
-            comment,
-            family_id,
-            approved,
-        ),
-    )
-    income_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    if approved == 0:
-        # Notify family head for approval
-        notify_family_head(family_id, income_id, 'income', user_id)
+    with transaction() as c:
+        profile = get_user_profile(user_id)
+        family_id = profile.family_id if profile else None
+        approved = 1
+        if profile and profile.role == 'member' and family_id is not None:
+            approved = 0  # Needs approval from head
+        c.execute(
+            'INSERT INTO incomes (user_id, date, amount, currency, category, comment, family_id, approved) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                user_id,
+                current_time,
+                user_data['income_amount'],
+                user_data['income_currency'],
+                user_data['income_category'],
+                comment,
+                family_id,
+                approved,
+            ),
+        )
+        income_id = c.lastrowid
+        if approved:
+            _update_rollups(
+                c, 'incomes', user_id, family_id, current_time, user_data['income_amount'],
+                user_data['income_currency'], user_data['income_category'],
+            )
+    return SavedTransaction(BUDGET_OK, income_id, family_id, not approved)
 
 
 def save_expense(user_id, user_data):
-    from family_budget import notify_family_head
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
+    # The status is BUDGET_OK, or for a member's expense over their remaining
+    # budget BUDGET_FLAGGED (saved, head is warned) / BUDGET_REJECTED (not
+    # saved) depending on BUDGET_ENFORCEMENT
     current_time = datetime.now()
     # Sanitize comment input
     comment = sanitize_comment(user_data['expense_comment'])
-    family_id = get_user_family_id(user_id)
-    approved = 1
-    role = get_user_role(user_id)
-    if role == 'member' and family_id is not None:
-        approved = 0  # Needs approval from head
-    c.execute(
-        'INSERT INTO expenses (user_id, date, amount, currency, category, comment, family_id, approved) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-        (
-            user_id,
-            current_time,
-            user_data['expense_amount'],
-            user_data['expense_currency'],
-            user_data['expense_category'],
-            comment,
-            family_id,
-            approved,
-        ),
-    )
-    expense_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    if approved == 0:
-        # Notify family head for approval
-        notify_family_head(family_id, expense_id, 'expense', user_id)
+    status = BUDGET_OK
+    with transaction() as c:
+        profile = get_user_profile(user_id)
+        family_id = profile.family_id if profile else None
+        approved = 1
+        if profile and profile.role == 'member' and family_id is not None:
+            approved = 0  # Needs approval from head
+            over_budget = profile.budget is not None and user_data['expense_amount'] > profile.budget
+            if BUDGET_ENFORCEMENT != 'off' and over_budget:
+                status = BUDGET_REJECTED if BUDGET_ENFORCEMENT == 'reject' else BUDGET_FLAGGED
+                if status == BUDGET_REJECTED:
+                    return SavedTransaction(status, None, family_id, False)
+        c.execute(
+            'INSERT INTO expenses (user_id, date, amount, currency, category, comment, family_id, approved) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                user_id,
+                current_time,
+                user_data['expense_amount'],
+                user_data['expense_currency'],
+                user_data['expense_category'],
+                comment,
+                family_id,
+                approved,
+            ),
+        )
+        expense_id = c.lastrowid
+        if approved:
+            _update_rollups(
+                c, 'expenses', user_id, family_id, current_time, user_data['expense_amount'],
+                user_data['expense_currency'], user_data['expense_category'],
+            )
+    return SavedTransaction(status, expense_id, family_id, not approved)
+
+
+def insert_transactions(user_id, family_id, rows):
+    # Approved transactions in bulk (see transaction_import), all in one
+    # transaction: rows of (table, date, amount, currency, category, comment).
+    # Returns the scopes whose totals changed.
+    scopes = [('user_id', user_id)]
+    if family_id is not None:
+        scopes.append(('family_id', family_id))
+    with transaction() as c:
+        for table, kind in ROLLUP_KINDS.items():
+            table_rows = [row[1:] for row in rows if row[0] == table]
+            if not table_rows:
+                continue
+            c.executemany(
+                f'INSERT INTO {table} (user_id, date, amount, currency, category, comment, family_id, approved) VALUES (?, ?, ?, ?, ?, ?, ?, 1)',
+                [(user_id,) + row + (family_id,) for row in table_rows],
+            )
+            c.executemany(
+                ROLLUP_UPSERT,
+                [
+                    scope + (str(date)[:10], kind, currency, category, amount, 1)
+                    for date, amount, currency, category, _ in table_rows
+                    for scope in scopes
+                ],
+            )
+        c.executemany(SCOPE_VERSION_BUMP, scopes)
+    return scopes
+
+
+# Transaction type -> table
+TRANSACTION_TABLES = {'income': 'incomes', 'expense': 'expenses'}
+
+
+# approve_transaction() statuses; ALREADY_DECIDED is also what
+# reject_transaction() returns for a transaction that was approved or
+# rejected before (or never existed)
+APPROVED = 'approved'
+OVER_BUDGET = 'over_budget'
+ALREADY_DECIDED = 'decided'
+
+
+class Approval(NamedTuple):
+    # APPROVED, OVER_BUDGET (an expense over the member's remaining budget
+    # with BUDGET_ENFORCEMENT 'reject', it stays pending) or ALREADY_DECIDED
+    status: str
+    # Report scopes whose totals changed, empty unless APPROVED
+    scopes: tuple
 
 
 def approve_transaction(transaction_id, transaction_type):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    if transaction_type == 'income':
-        c.execute('UPDATE incomes SET approved = 1 WHERE id = ?', (transaction_id,))
-    elif transaction_type == 'expense':
-        c.execute('UPDATE expenses SET approved = 1 WHERE id = ?', (transaction_id,))
-    conn.commit()
-    conn.close()
+    table = TRANSACTION_TABLES.get(transaction_type)
+    if table is None:
+        return Approval(ALREADY_DECIDED, ())
+    with transaction() as c:
+        c.execute(
+            f'SELECT user_id, family_id, date, amount, currency, category FROM {table} WHERE id = ? AND approved = 0',
+            (transaction_id,),
+        )
+        row = c.fetchone()
+        if row is None:
+            # Unknown, already approved or rejected
+            return Approval(ALREADY_DECIDED, ())
+        user_id, amount = row[0], row[3]
+        if table == 'expenses' and amount is not None:
+            if not _deduct_budget(c, user_id, amount, allow_overdraft=BUDGET_ENFORCEMENT != 'reject'):
+                return Approval(OVER_BUDGET, ())
+        c.execute(f'UPDATE {table} SET approved = 1 WHERE id = ?', (transaction_id,))
+        scopes = _update_rollups(c, table, *row)
+    invalidate_user_profile(user_id)
+    return Approval(APPROVED, tuple(scopes))
 
 
 def reject_transaction(transaction_id, transaction_type):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    if transaction_type == 'income':
-        c.execute('DELETE FROM incomes WHERE id = ?', (transaction_id,))
-    elif transaction_type == 'expense':
-        c.execute('DELETE FROM expenses WHERE id = ?', (transaction_id,))
-    conn.commit()
-    conn.close()
+    # Deletes a pending transaction; an approved one has been counted and
+    # paid from the budget, so it stays. Returns ALREADY_DECIDED if nothing
+    # was pending.
+    table = TRANSACTION_TABLES.get(transaction_type)
+    if table is None:
+        return ALREADY_DECIDED
+    with transaction() as c:
+        c.execute(f'DELETE FROM {table} WHERE id = ? AND approved = 0', (transaction_id,))
+        if not c.rowcount:
+            return ALREADY_DECIDED
+    return None
 
 
 def get_family_head_id(family_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT head_id FROM families WHERE family_id = ?', (family_id,))
+    c = get_connection().execute('SELECT head_id FROM families WHERE family_id = ?', (family_id,))
     result = c.fetchone()
-    conn.close()
     if result:
         return result[0]
     else:
@@ -266,30 +683,97 @@ def get_family_head_id(family_id):
 
 
 def get_user_budget(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT budget FROM users WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return result[0]
+    # None without a budget
+    profile = get_user_profile(user_id)
+    if profile:
+        return profile.budget
     else:
-        return 0
+        return None
 
 
 def set_user_budget(user_id, amount):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('UPDATE users SET budget = ? WHERE user_id = ?', (amount, user_id))
-    conn.commit()
-    conn.close()
-
-
-def reduce_user_budget(user_id, amount):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    current_budget = get_user_budget(user_id)
-    new_budget = current_budget - amount
-    c.execute('UPDATE users SET budget = ? WHERE user_id = ?', (new_budget, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute('UPDATE users SET budget = ? WHERE user_id = ?', (amount, user_id))
+    invalidate_user_profile(user_id)
+
+
+def set_family_budget(family_id, amount, role='member'):
+    # Same budget for every family member with the role, in one statement.
+    # Returns the number of members updated.
+    with transaction() as c:
+        c.execute('SELECT user_id FROM users WHERE family_id = ? AND role = ?', (family_id, role))
+        member_ids = [row[0] for row in c.fetchall()]
+        c.execute('UPDATE users SET budget = ? WHERE family_id = ? AND role = ?', (amount, family_id, role))
+    invalidate_user_profile(*member_ids)
+    return len(member_ids)
+
+
+def set_member_budgets(family_id, budgets):
+    # Per-member budgets ({user_id: amount}) in one transaction; users outside
+    # the family are skipped. Returns the number of members updated.
+    with transaction() as c:
+        before = c.connection.total_changes
+        c.executemany(
+            'UPDATE users SET budget = ? WHERE user_id = ? AND family_id = ?',
+            [(amount, user_id, family_id) for user_id, amount in budgets.items()],
+        )
+        count = c.connection.total_changes - before
+    invalidate_user_profile(*budgets)
+    return count
+
+
+def _deduct_budget(c, user_id, amount, allow_overdraft=True):
+    # Only family members whose head set a budget have one to spend. Without
+    # overdraft the remaining budget must cover the amount; returns False if
+    # it didn't.
+    query = "UPDATE users SET budget = budget - ? WHERE user_id = ? AND role = 'member' AND budget IS NOT NULL"
+    params = [amount, user_id]
+    if not allow_overdraft:
+        query += ' AND budget >= ?'
+        params.append(amount)
+    c.execute(query, params)
+    if c.rowcount:
+        return True
+    # Nothing updated: fine for users without a budget, a refusal otherwise
+    c.execute("SELECT 1 FROM users WHERE user_id = ? AND role = 'member' AND budget IS NOT NULL", (user_id,))
+    return c.fetchone() is None
+
+
+def reduce_user_budget(user_id, amount, allow_overdraft=True):
+    with transaction() as c:
+        deducted = _deduct_budget(c, user_id, amount, allow_overdraft)
+    invalidate_user_profile(user_id)
+    return deducted
+
+
+def load_user_state(user_id):
+    row = get_connection().execute('SELECT data FROM user_state WHERE user_id = ?', (user_id,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def load_conversation_states(name):
+    c = get_connection().execute(
+        'SELECT conversation_key, state FROM conversation_states WHERE name = ?', (name,)
+    )
+    return {tuple(json.loads(key)): state for key, state in c.fetchall()}
+
+
+def save_bot_state(user_data, conversations):
+    # One transaction for everything changed since the last save:
+    # {user_id: dict or None} and {(name, key): state or None}, None deletes
+    stored_users = [(user_id, json.dumps(data)) for user_id, data in user_data.items() if data]
+    empty_users = [(user_id,) for user_id, data in user_data.items() if not data]
+    stored_conversations = [
+        (name, json.dumps(key), state) for (name, key), state in conversations.items() if state is not None
+    ]
+    ended_conversations = [
+        (name, json.dumps(key)) for (name, key), state in conversations.items() if state is None
+    ]
+    with transaction() as c:
+        c.executemany('INSERT OR REPLACE INTO user_state (user_id, data) VALUES (?, ?)', stored_users)
+        c.executemany('DELETE FROM user_state WHERE user_id = ?', empty_users)
+        c.executemany(
+            'INSERT OR REPLACE INTO conversation_states (name, conversation_key, state) VALUES (?, ?, ?)',
+            stored_conversations,
+        )
+        c.executemany('DELETE FROM conversation_states WHERE name = ? AND conversation_key = ?', ended_conversations)
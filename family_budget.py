@@ -1,61 +1,69 @@
 # family_budget.py
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from db_functions import get_user_language
+from telegram.error import TelegramError
+from async_db import get_user_language, get_family_head_id, approve_transaction, reject_transaction
+from db_functions import ALREADY_DECIDED, OVER_BUDGET
 from utilities import delete_previous_bot_message
-from language_data import languages
-import sqlite3
-from telegram.ext import CallbackContext
+from localization import strings
+from chart_cache import invalidate_scope
 import logging
 
-def notify_family_head(family_id, transaction_id, transaction_type, member_id):
+async def notify_family_head(bot, family_id, transaction_id, transaction_type, member_id, over_budget=False):
     # Get head_id from families table
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT head_id FROM families WHERE family_id = ?', (family_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        head_id = result[0]
+    head_id = await get_family_head_id(family_id)
+    if head_id:
         # Send approval request to head
-        language = get_user_language(head_id)
-        member_language = get_user_language(member_id)
+        language = await get_user_language(head_id)
         message_text = f"Yangi {transaction_type} kiritildi. Tasdiqlaysizmi?"
+        if over_budget:
+            message_text += '\n' + strings(language)['insufficient_budget']
         keyboard = [
             [
-                InlineKeyboardButton(languages[language]['approve_expense'], callback_data=f'approve_{transaction_type}_{transaction_id}_{member_id}'),
-                InlineKeyboardButton(languages[language]['reject_expense'], callback_data=f'reject_{transaction_type}_{transaction_id}_{member_id}'),
+                InlineKeyboardButton(strings(language)['approve_expense'], callback_data=f'approve_{transaction_type}_{transaction_id}_{member_id}'),
+                InlineKeyboardButton(strings(language)['reject_expense'], callback_data=f'reject_{transaction_type}_{transaction_id}_{member_id}'),
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        # We need to get the bot instance from somewhere
-        # For simplicity, let's assume we have access to the context
-        # If not, you may need to refactor the code to pass the bot instance
         try:
-            bot = CallbackContext.bot
-            bot.send_message(chat_id=head_id, text=message_text, reply_markup=reply_markup)
+            await bot.send_message(chat_id=head_id, text=message_text, reply_markup=reply_markup)
         except Exception as e:
             logging.error(f"Error sending message to family head: {e}")
 
 
-def handle_approval(update, context):
-    from db_functions import get_user_language, approve_transaction, reject_transaction
+async def handle_approval(update, context):
     query = update.callback_query
     data = query.data
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     if data.startswith('approve_'):
         _, transaction_type, transaction_id, member_id = data.split('_')
-        approve_transaction(transaction_id, transaction_type)
-        query.answer(text=languages[language]['expense_approved'])
-        # Notify member
-        member_language = get_user_language(int(member_id))
-        context.bot.send_message(chat_id=int(member_id), text=languages[member_language]['expense_approved'])
+        approval = await approve_transaction(transaction_id, transaction_type)
+        if approval.status == OVER_BUDGET:
+            # Stays pending
+            await query.answer(text=strings(language)['insufficient_budget'])
+            return
+        if approval.status == ALREADY_DECIDED:
+            await query.answer(text=strings(language)['already_decided'])
+        else:
+            for scope in approval.scopes:
+                invalidate_scope(scope)
+            await query.answer(text=strings(language)['expense_approved'])
+            # Notify member
+            member_language = await get_user_language(int(member_id))
+            await context.bot.send_message(chat_id=int(member_id), text=strings(member_language)['expense_approved'])
     elif data.startswith('reject_'):
         _, transaction_type, transaction_id, member_id = data.split('_')
-        reject_transaction(transaction_id, transaction_type)
-        query.answer(text=languages[language]['expense_rejected'])
-        # Notify member
-        member_language = get_user_language(int(member_id))
-        context.bot.send_message(chat_id=int(member_id), text=languages[member_language]['expense_rejected'])
+        if await reject_transaction(transaction_id, transaction_type) == ALREADY_DECIDED:
+            await query.answer(text=strings(language)['already_decided'])
+        else:
+            await query.answer(text=strings(language)['expense_rejected'])
+            # Notify member
+            member_language = await get_user_language(int(member_id))
+            await context.bot.send_message(chat_id=int(member_id), text=strings(member_language)['expense_rejected'])
+    # Decided, the buttons can't be pressed again
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except TelegramError as e:
+        logging.warning(f"Failed to remove approval buttons: {e}")
     delete_previous_bot_message(update, context)
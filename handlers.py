@@ -1,34 +1,36 @@
 # handlers.py
-import sqlite3
-import os
-
-from telegram import (
-    Update,
-    InlineKeyboardButton,
-    InlineKeyboardMarkup,
-    ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
-)
+
+import asyncio
+import logging
+from telegram import InputFile, Update
 from telegram.ext import (
-    CallbackContext,
+    ContextTypes,
     ConversationHandler,
 )
-from db_functions import (
-    init_db,
+from async_db import (
     get_user_language,
     set_user_language,
     is_first_time_user,
+    mark_user_returning,
     save_income,
     save_expense,
     create_family,
     join_family,
     get_user_role,
     get_user_family_id,
-    set_user_budget,
+    set_family_budget,
+    get_data_version,
+    import_transactions,
 )
-from language_data import languages
-from utilities import delete_previous_bot_message, delete_user_message, delete_message
-from report_generation import create_report, create_text_report, create_graph_report
+from db_functions import BUDGET_FLAGGED, BUDGET_REJECTED
+from localization import strings, keyboards, LANGUAGE_CHOICE, REMOVE_KEYBOARD
+from utilities import delete_previous_bot_message, delete_user_message, delete_message_later
+from menu_routes import route_menu
+from quick_add import parse_quick_add, UnknownCategory
+from conversation_ui import render_step, finish_flow
+from family_budget import notify_family_head
+from report_worker import submit_report, remove_report_file, REPORT_ACCEPTED, REPORT_USER_BUSY
+from chart_cache import get_chart, store_chart, invalidate_scope
 from constants import (
     LANGUAGE_SELECTION,
     INCOME_AMOUNT,
@@ -49,122 +51,95 @@ from constants import (
     FAMILY_BUDGET_SET_AMOUNT,
     SETTINGS_SELECTION,
 )
-from constants import CURRENCIES
+from constants import IMPORT_MAX_FILE_SIZE
 
-def start(update: Update, context: CallbackContext):
-    init_db()
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     if language is None:
         # Ask for language selection
-        keyboard = [
-            [InlineKeyboardButton("O'zbekcha", callback_data='lang_uz')],
-            [InlineKeyboardButton("Русский", callback_data='lang_ru')],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message = update.message.reply_text(
-            "Iltimos, tilni tanlang:\nПожалуйста, выберите язык:", reply_markup=reply_markup
+        message = await update.message.reply_text(
+            "Iltimos, tilni tanlang:\nПожалуйста, выберите язык:", reply_markup=LANGUAGE_CHOICE
         )
         context.user_data['last_bot_message_id'] = message.message_id
         return LANGUAGE_SELECTION
     else:
         # Proceed to main menu
-        show_main_menu(update, context, language)
+        await show_main_menu(update, context, language)
         return ConversationHandler.END
 
-def language_selection(update: Update, context: CallbackContext):
+async def language_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    query.answer()
+    await query.answer()
     user_id = update.effective_user.id
     data = query.data
     if data == 'lang_uz':
-        set_user_language(user_id, 'uz')
+        await set_user_language(user_id, 'uz')
         language = 'uz'
     elif data == 'lang_ru':
-        set_user_language(user_id, 'ru')
+        await set_user_language(user_id, 'ru')
         language = 'ru'
     else:
         # Should not happen
         language = 'uz'
     delete_previous_bot_message(update, context)
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def show_main_menu(update: Update, context: CallbackContext, language):
-    keyboard = [
-        [languages[language]['income'], languages[language]['expense']],
-        [languages[language]['report'], languages[language]['family_budget']],
-        [languages[language]['settings']],
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, language):
+    reply_markup = keyboards(language).main_menu
     chat_id = update.effective_chat.id
 
     user_id = update.effective_user.id
-    first_time = is_first_time_user(user_id)
+    first_time = await is_first_time_user(user_id)
 
     if first_time:
-        message_text = languages[language]['start_message_new']
+        message_text = strings(language)['start_message_new']
         # Update first_time to False after greeting
-        conn = sqlite3.connect('bot_database.db')
-        c = conn.cursor()
-        c.execute('UPDATE users SET first_time = 0 WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        await mark_user_returning(user_id)
     else:
-        message_text = languages[language]['start_message_returning']
+        message_text = strings(language)['start_message_returning']
 
-    message = context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+    message = await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
     context.user_data['last_bot_message_id'] = message.message_id
 
-def main_menu_selection(update: Update, context: CallbackContext):
+async def main_menu_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     delete_user_message(update, context)
     delete_previous_bot_message(update, context)
 
-    if user_input == languages[language]['income']:
-        context.user_data.clear()
-        income_start(update, context)
-    elif user_input == languages[language]['expense']:
-        context.user_data.clear()
-        expense_start(update, context)
-    elif user_input == languages[language]['report']:
-        context.user_data.clear()
-        report_start(update, context)
-    elif user_input == languages[language]['family_budget']:
+    action = route_menu(user_input)
+    if action is not None:
         context.user_data.clear()
-        family_budget_start(update, context)
-    elif user_input == languages[language]['settings']:
-        context.user_data.clear()
-        settings(update, context)
+        await MENU_HANDLERS[action](update, context)
     else:
         # Send a message indicating incorrect selection
-        message_text = languages[language]['incorrect_selection']
+        message_text = strings(language)['incorrect_selection']
         chat_id = update.effective_chat.id
-        message = context.bot.send_message(chat_id=chat_id, text=message_text)
+        message = await context.bot.send_message(chat_id=chat_id, text=message_text)
         context.user_data['last_bot_message_id'] = message.message_id
 
-def income_start(update: Update, context: CallbackContext):
+async def income_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    keyboard = [[languages[language]['cancel']]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    message_text = languages[language]['enter_income_amount']
+    language = await get_user_language(user_id)
+    reply_markup = keyboards(language).cancel
+    message_text = strings(language)['enter_income_amount']
     chat_id = update.effective_chat.id
-    message = context.bot.send_message(
+    message = await context.bot.send_message(
         chat_id=chat_id, text=message_text, reply_markup=reply_markup
     )
     context.user_data['last_bot_message_id'] = message.message_id
     return INCOME_AMOUNT
 
-def income_amount_received(update: Update, context: CallbackContext):
+async def income_amount_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
-    if user_input == languages[language]['cancel']:
-        cancel(update, context)
+    if user_input == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
 
     # Validate that the input is a number
@@ -172,113 +147,83 @@ def income_amount_received(update: Update, context: CallbackContext):
         amount = float(user_input)
         context.user_data['income_amount'] = amount
         delete_user_message(update, context)
-        delete_previous_bot_message(update, context)
     except ValueError:
         # Not a valid number
         delete_user_message(update, context)
-        message_text = languages[language]['invalid_amount']
-        keyboard = [[languages[language]['cancel']]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message = context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=message_text,
-            reply_markup=reply_markup
-        )
-        context.user_data['last_bot_message_id'] = message.message_id
+        message_text = strings(language)['invalid_amount']
+        reply_markup = keyboards(language).cancel
+        await render_step(update, context, message_text, reply_markup)
         return INCOME_AMOUNT
 
-    keyboard = [[InlineKeyboardButton(currency, callback_data=currency)] for currency in CURRENCIES]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = languages[language]['choose_currency']
-    chat_id = update.effective_chat.id
-    message = context.bot.send_message(
-        chat_id=chat_id, text=message_text, reply_markup=reply_markup
-    )
-    context.user_data['last_bot_message_id'] = message.message_id
+    reply_markup = keyboards(language).currencies
+    message_text = strings(language)['choose_currency']
+    await render_step(update, context, message_text, reply_markup)
     return INCOME_CURRENCY
 
-def income_currency_received(update: Update, context: CallbackContext):
+async def income_currency_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     context.user_data['income_currency'] = query.data
-    query.answer()
-    delete_previous_bot_message(update, context)
+    await query.answer()
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
     # Prompt for category selection
-    categories = languages[language]['income_categories']
-    keyboard = []
-    for label, data in categories:
-        keyboard.append([InlineKeyboardButton(label, callback_data=data)])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = languages[language]['choose_category']
-    message = context.bot.send_message(
-        chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup
-    )
-    context.user_data['last_bot_message_id'] = message.message_id
+    reply_markup = keyboards(language).income_categories
+    message_text = strings(language)['choose_category']
+    await render_step(update, context, message_text, reply_markup)
     return INCOME_CATEGORY
 
-def income_category_received(update: Update, context: CallbackContext):
+async def income_category_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     context.user_data['income_category'] = query.data
-    query.answer()
-    delete_previous_bot_message(update, context)
+    await query.answer()
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    keyboard = [[languages[language]['cancel']]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    message_text = languages[language]['enter_comment']
-    chat_id = update.effective_chat.id
-    message = context.bot.send_message(
-        chat_id=chat_id, text=message_text, reply_markup=reply_markup
-    )
-    context.user_data['last_bot_message_id'] = message.message_id
+    language = await get_user_language(user_id)
+    # The cancel keyboard from the amount prompt is still shown
+    message_text = strings(language)['enter_comment']
+    await render_step(update, context, message_text)
     return INCOME_COMMENT
 
-def income_comment_received(update: Update, context: CallbackContext):
+async def income_comment_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
-    if user_input == languages[language]['cancel']:
-        cancel(update, context)
+    if user_input == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
 
     delete_user_message(update, context)
-    delete_previous_bot_message(update, context)
     context.user_data['income_comment'] = user_input
-    save_income(user_id, context.user_data)
-    # Send notification and delete after 3 seconds
-    chat_id = update.effective_chat.id
-    message_text = languages[language]['data_saved']
-    message = context.bot.send_message(chat_id=chat_id, text=message_text)
-    context.job_queue.run_once(
-        delete_message, 3, context={'chat_id': chat_id, 'message_id': message.message_id}
-    )
+    saved = await save_income(user_id, context.user_data)
+    if saved.pending:
+        # Notify family head for approval
+        await notify_family_head(context.bot, saved.family_id, saved.transaction_id, 'income', user_id)
+    # Show the outcome in place of the prompt and delete after 3 seconds
+    await finish_flow(update, context, strings(language)['data_saved'])
     # Return to main menu
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def expense_start(update: Update, context: CallbackContext):
+async def expense_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    keyboard = [[languages[language]['cancel']]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    message_text = languages[language]['enter_expense_amount']
+    language = await get_user_language(user_id)
+    reply_markup = keyboards(language).cancel
+    message_text = strings(language)['enter_expense_amount']
     chat_id = update.effective_chat.id
-    message = context.bot.send_message(
+    message = await context.bot.send_message(
         chat_id=chat_id, text=message_text, reply_markup=reply_markup
     )
     context.user_data['last_bot_message_id'] = message.message_id
     return EXPENSE_AMOUNT
 
-def expense_amount_received(update: Update, context: CallbackContext):
+async def expense_amount_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
-    if user_input == languages[language]['cancel']:
-        cancel(update, context)
+    if user_input == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
 
     # Validate that the input is a number
@@ -286,409 +231,461 @@ def expense_amount_received(update: Update, context: CallbackContext):
         amount = float(user_input)
         context.user_data['expense_amount'] = amount
         delete_user_message(update, context)
-        delete_previous_bot_message(update, context)
     except ValueError:
         # Not a valid number
         delete_user_message(update, context)
-        message_text = languages[language]['invalid_amount']
-        keyboard = [[languages[language]['cancel']]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message = context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=message_text,
-            reply_markup=reply_markup
-        )
-        context.user_data['last_bot_message_id'] = message.message_id
+        message_text = strings(language)['invalid_amount']
+        reply_markup = keyboards(language).cancel
+        await render_step(update, context, message_text, reply_markup)
         return EXPENSE_AMOUNT
 
-    keyboard = [[InlineKeyboardButton(currency, callback_data=currency)] for currency in CURRENCIES]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = languages[language]['choose_currency']
-    chat_id = update.effective_chat.id
-    message = context.bot.send_message(
-        chat_id=chat_id, text=message_text, reply_markup=reply_markup
-    )
-    context.user_data['last_bot_message_id'] = message.message_id
+    reply_markup = keyboards(language).currencies
+    message_text = strings(language)['choose_currency']
+    await render_step(update, context, message_text, reply_markup)
     return EXPENSE_CURRENCY
 
-def expense_currency_received(update: Update, context: CallbackContext):
+async def expense_currency_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     context.user_data['expense_currency'] = query.data
-    query.answer()
-    delete_previous_bot_message(update, context)
+    await query.answer()
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
     # Prompt for category selection
-    categories = languages[language]['expense_categories']
-    keyboard = []
-    for label, data in categories:
-        keyboard.append([InlineKeyboardButton(label, callback_data=data)])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = languages[language]['choose_category']
-    message = context.bot.send_message(
-        chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup
-    )
-    context.user_data['last_bot_message_id'] = message.message_id
+    reply_markup = keyboards(language).expense_categories
+    message_text = strings(language)['choose_category']
+    await render_step(update, context, message_text, reply_markup)
     return EXPENSE_CATEGORY
 
-def expense_category_received(update: Update, context: CallbackContext):
+async def expense_category_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     context.user_data['expense_category'] = query.data
-    query.answer()
-    delete_previous_bot_message(update, context)
+    await query.answer()
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    keyboard = [[languages[language]['cancel']]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    message_text = languages[language]['enter_comment']
-    chat_id = update.effective_chat.id
-    message = context.bot.send_message(
-        chat_id=chat_id, text=message_text, reply_markup=reply_markup
-    )
-    context.user_data['last_bot_message_id'] = message.message_id
+    language = await get_user_language(user_id)
+    # The cancel keyboard from the amount prompt is still shown
+    message_text = strings(language)['enter_comment']
+    await render_step(update, context, message_text)
     return EXPENSE_COMMENT
 
-def expense_comment_received(update: Update, context: CallbackContext):
+async def expense_comment_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
-    if user_input == languages[language]['cancel']:
-        cancel(update, context)
+    if user_input == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
 
     delete_user_message(update, context)
-    delete_previous_bot_message(update, context)
     context.user_data['expense_comment'] = user_input
-    save_expense(user_id, context.user_data)
-    # Send notification and delete after 3 seconds
-    chat_id = update.effective_chat.id
-    message_text = languages[language]['data_saved']
-    message = context.bot.send_message(chat_id=chat_id, text=message_text)
-    context.job_queue.run_once(
-        delete_message, 3, context={'chat_id': chat_id, 'message_id': message.message_id}
-    )
+    saved = await save_expense(user_id, context.user_data)
+    if saved.pending:
+        # Notify family head for approval
+        await notify_family_head(
+            context.bot, saved.family_id, saved.transaction_id, 'expense', user_id,
+            over_budget=saved.status == BUDGET_FLAGGED,
+        )
+    # Show the outcome in place of the prompt and delete after 3 seconds
+    await finish_flow(update, context, expense_saved_text(language, saved))
     # Return to main menu
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def report_start(update: Update, context: CallbackContext):
+def expense_saved_text(language, saved):
+    message_text = strings(language)['data_saved']
+    if saved.status == BUDGET_REJECTED:
+        message_text = strings(language)['insufficient_budget']
+    elif saved.status == BUDGET_FLAGGED:
+        message_text += '\n' + strings(language)['insufficient_budget']
+    return message_text
+
+async def quick_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # "-25000 UZS Oziq-ovqat tushlik": the whole expense/income flow in one message
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    keyboard = [
-        [InlineKeyboardButton(languages[language]['weekly'], callback_data='weekly')],
-        [InlineKeyboardButton(languages[language]['monthly'], callback_data='monthly')],
-        [InlineKeyboardButton(languages[language]['graph_report'], callback_data='graph_report')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = languages[language]['choose_report']
+    language = await get_user_language(user_id)
     chat_id = update.effective_chat.id
-    message = context.bot.send_message(
+    try:
+        entry = parse_quick_add(update.message.text, language)
+    except UnknownCategory as e:
+        categories = ', '.join(name for _, name in strings(language)[f'{e.kind}_categories'])
+        message_text = strings(language)['quick_add_unknown_category'].format(categories=categories)
+        await context.bot.send_message(chat_id=chat_id, text=message_text)
+        return
+    except ValueError:
+        await context.bot.send_message(chat_id=chat_id, text=strings(language)['quick_add_help'])
+        return
+    kind = entry.kind
+    user_data = {
+        f'{kind}_amount': entry.amount,
+        f'{kind}_currency': entry.currency,
+        f'{kind}_category': entry.category,
+        f'{kind}_comment': entry.comment,
+    }
+    if kind == 'income':
+        saved = await save_income(user_id, user_data)
+        message_text = strings(language)['data_saved']
+    else:
+        saved = await save_expense(user_id, user_data)
+        message_text = expense_saved_text(language, saved)
+    if saved.pending:
+        # Notify family head for approval
+        await notify_family_head(
+            context.bot, saved.family_id, saved.transaction_id, kind, user_id,
+            over_budget=saved.status == BUDGET_FLAGGED,
+        )
+    await context.bot.send_message(chat_id=chat_id, text=message_text)
+
+async def report_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    language = await get_user_language(user_id)
+    reply_markup = keyboards(language).report_periods
+    message_text = strings(language)['choose_report']
+    chat_id = update.effective_chat.id
+    message = await context.bot.send_message(
         chat_id=chat_id, text=message_text, reply_markup=reply_markup
     )
     context.user_data['last_bot_message_id'] = message.message_id
     return REPORT_SELECTION
 
-def report_selection(update: Update, context: CallbackContext):
+async def report_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     selection = query.data
     context.user_data['report_period'] = selection  # Save the period
-    query.answer()
+    await query.answer()
     delete_previous_bot_message(update, context)
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
     if selection == 'graph_report':
         # Present graph options
-        keyboard = [
-            [InlineKeyboardButton(languages[language]['income_expense_over_time'], callback_data='income_expense_over_time')],
-            [InlineKeyboardButton(languages[language]['category_distribution'], callback_data='category_distribution')],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message_text = languages[language]['select_graph_type']
-        message = context.bot.send_message(
+        reply_markup = keyboards(language).graph_types
+        message_text = strings(language)['select_graph_type']
+        message = await context.bot.send_message(
             chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup
         )
         context.user_data['last_bot_message_id'] = message.message_id
         return GRAPH_REPORT_SELECTION
     else:
         # Present options: View in Telegram or Download
-        keyboard = [
-            [
-                InlineKeyboardButton(languages[language]['view_in_telegram'], callback_data='view_in_telegram'),
-                InlineKeyboardButton(languages[language]['download'], callback_data='download'),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message_text = languages[language]['select_language']
-        message = context.bot.send_message(
+        reply_markup = keyboards(language).report_actions
+        message_text = strings(language)['select_language']
+        message = await context.bot.send_message(
             chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup
         )
         context.user_data['last_bot_message_id'] = message.message_id
         return REPORT_ACTION_SELECTION
 
-def report_action_selection(update: Update, context: CallbackContext):
+async def report_action_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     action = query.data
-    query.answer()
+    await query.answer()
     delete_previous_bot_message(update, context)
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     period = context.user_data.get('report_period')
 
     if action == 'view_in_telegram':
-        report_text = create_text_report(user_id, period, language)
-        if report_text:
-            context.bot.send_message(chat_id=update.effective_chat.id, text=report_text)
-        else:
-            message_text = languages[language]['no_data']
-            message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
-            context.user_data['last_bot_message_id'] = message.message_id
+        await start_report(update, context, language, 'text', (user_id, period, language))
     elif action == 'download':
-        file_name = create_report(user_id, period, language)
-        if file_name and os.path.isfile(file_name):
-            with open(file_name, 'rb') as f:
-                context.bot.send_document(chat_id=update.effective_chat.id, document=f)
-            os.remove(file_name)
-        else:
-            message_text = languages[language]['no_data']
-            message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
-            context.user_data['last_bot_message_id'] = message.message_id
+        await start_report(update, context, language, 'excel', (user_id, period, language))
 
-    # Send notification and delete after 3 seconds
-    chat_id = update.effective_chat.id
-    message_text = languages[language]['report_sent']
-    message = context.bot.send_message(chat_id=chat_id, text=message_text)
-    context.job_queue.run_once(
-        delete_message, 3, context={'chat_id': chat_id, 'message_id': message.message_id}
-    )
-    # Return to main menu
-    show_main_menu(update, context, language)
+    # Return to main menu, the report follows when it is ready
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def graph_report_selection(update: Update, context: CallbackContext):
+async def graph_report_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     graph_type = query.data
-    query.answer()
+    await query.answer()
     delete_previous_bot_message(update, context)
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-
-    buffer = create_graph_report(user_id, graph_type, language)
-    if buffer:
-        context.bot.send_photo(chat_id=update.effective_chat.id, photo=buffer)
-        buffer.close()
+    language = await get_user_language(user_id)
+
+    # Charts only change when the scope's data does, so a repeat request
+    # for the same data version is answered from the cache
+    scope, version = await get_data_version(user_id)
+    cache_key = (scope, graph_type, language)
+    png = get_chart(cache_key, version)
+    if png is not None:
+        await context.bot.send_photo(chat_id=update.effective_chat.id, photo=png)
     else:
-        message_text = languages[language]['no_data']
-        context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        await start_report(
+            update, context, language, 'graph', (user_id, graph_type, language),
+            on_result=lambda payload: store_chart(cache_key, version, payload),
+        )
 
-    # Return to main menu
-    show_main_menu(update, context, language)
+    # Return to main menu, the graph follows when it is ready
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def family_budget_start(update: Update, context: CallbackContext):
+async def start_report(update: Update, context: ContextTypes.DEFAULT_TYPE, language, kind, args, on_result=None):
+    # Reports render in the worker pool; the user sees a placeholder meanwhile.
+    # on_result(payload) is called with every successful render.
+    chat_id = update.effective_chat.id
+    placeholder = await context.bot.send_message(chat_id=chat_id, text=strings(language)['report_preparing'])
+    loop = asyncio.get_running_loop()
+
+    def on_done(payload, error):
+        # Pool thread: hand the delivery to the event loop
+        if on_result is not None and error is None and payload is not None:
+            on_result(payload)
+        loop.call_soon_threadsafe(
+            context.application.create_task,
+            deliver_report(context, chat_id, placeholder.message_id, language, kind, payload, error),
+        )
+
+    status = submit_report(update.effective_user.id, kind, args, on_done)
+    if status != REPORT_ACCEPTED:
+        message_text = strings(language)['report_in_progress' if status == REPORT_USER_BUSY else 'report_busy']
+        await context.bot.edit_message_text(chat_id=chat_id, message_id=placeholder.message_id, text=message_text)
+        delete_message_later(context, chat_id, placeholder.message_id)
+
+async def deliver_report(context: ContextTypes.DEFAULT_TYPE, chat_id, message_id, language, kind, payload, error):
+    if error is not None or payload is None:
+        message_text = strings(language)['error_generating_report' if error is not None else 'no_data']
+        await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=message_text)
+        return
+    if kind == 'text':
+        await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=payload)
+    else:
+        delete_message_later(context, chat_id, message_id, delay=0)
+        if kind == 'excel':
+            path, file_name = payload
+            try:
+                with open(path, 'rb') as file:
+                    # Streamed from the file by the HTTP client, not read into memory
+                    document = InputFile(file, filename=file_name, read_file_handle=False)
+                    await context.bot.send_document(chat_id=chat_id, document=document)
+            finally:
+                remove_report_file(path)
+        else:
+            await context.bot.send_photo(chat_id=chat_id, photo=payload)
+            return
+    # Send notification and delete after 3 seconds
+    message = await context.bot.send_message(chat_id=chat_id, text=strings(language)['report_sent'])
+    delete_message_later(context, chat_id, message.message_id)
+
+async def family_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    role = get_user_role(user_id)
+    language = await get_user_language(user_id)
+    role = await get_user_role(user_id)
 
     if role == 'head':
-        keyboard = [
-            [languages[language]['set_budget']],
-            [languages[language]['cancel']],
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message_text = languages[language]['select_language']
+        reply_markup = keyboards(language).family_head_menu
+        message_text = strings(language)['select_language']
         chat_id = update.effective_chat.id
-        message = context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+        message = await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_BUDGET_ACTIONS
     elif role == 'member':
-        message_text = languages[language]['request_sent']
-        context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        message_text = strings(language)['request_sent']
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
         # Return to main menu
-        show_main_menu(update, context, language)
+        await show_main_menu(update, context, language)
         return ConversationHandler.END
     else:
-        keyboard = [
-            [languages[language]['register_family']],
-            [languages[language]['join_family']],
-            [languages[language]['cancel']],
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message_text = languages[language]['select_language']
+        reply_markup = keyboards(language).family_menu
+        message_text = strings(language)['select_language']
         chat_id = update.effective_chat.id
-        message = context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+        message = await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_BUDGET_MENU
 
-def family_budget_menu_selection(update: Update, context: CallbackContext):
+async def family_budget_menu_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     delete_user_message(update, context)
     delete_previous_bot_message(update, context)
 
-    if user_input == languages[language]['register_family']:
+    if user_input == strings(language)['register_family']:
         # Proceed to family creation
         message_text = "Iltimos, oilangiz nomini kiriting:"
-        keyboard = [[languages[language]['cancel']]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup)
+        reply_markup = keyboards(language).cancel
+        message = await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_CREATE
-    elif user_input == languages[language]['join_family']:
+    elif user_input == strings(language)['join_family']:
         # Proceed to joining a family
         message_text = "Iltimos, oilangiz ID raqamini kiriting:"
-        keyboard = [[languages[language]['cancel']]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup)
+        reply_markup = keyboards(language).cancel
+        message = await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_JOIN
-    elif user_input == languages[language]['cancel']:
-        cancel(update, context)
+    elif user_input == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
     else:
-        message_text = languages[language]['incorrect_selection']
-        message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        message_text = strings(language)['incorrect_selection']
+        message = await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_BUDGET_MENU
 
-def family_create(update: Update, context: CallbackContext):
+async def family_create(update: Update, context: ContextTypes.DEFAULT_TYPE):
     family_name = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    if family_name == languages[language]['cancel']:
-        cancel(update, context)
+    language = await get_user_language(user_id)
+    if family_name == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
-    create_family(family_name, user_id)
-    message_text = f"Oila yaratildi. Oila ID si: {get_user_family_id(user_id)}"
-    context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+    family_id = await create_family(family_name, user_id)
+    message_text = f"Oila yaratildi. Oila ID si: {family_id}"
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
     # Return to main menu
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def family_join(update: Update, context: CallbackContext):
+async def family_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
     family_id = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    if family_id == languages[language]['cancel']:
-        cancel(update, context)
+    language = await get_user_language(user_id)
+    if family_id == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
     try:
         family_id = int(family_id)
-        join_family(user_id, family_id)
-        message_text = languages[language]['request_sent']
-        context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        await join_family(user_id, family_id)
+        message_text = strings(language)['request_sent']
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
     except ValueError:
-        message_text = languages[language]['incorrect_selection']
-        context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        message_text = strings(language)['incorrect_selection']
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
     # Return to main menu
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def family_budget_actions(update: Update, context: CallbackContext):
+async def family_budget_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     delete_user_message(update, context)
     delete_previous_bot_message(update, context)
 
-    if user_input == languages[language]['set_budget']:
-        message_text = languages[language]['enter_budget_amount']
-        keyboard = [[languages[language]['cancel']]]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup)
+    if user_input == strings(language)['set_budget']:
+        message_text = strings(language)['enter_budget_amount']
+        reply_markup = keyboards(language).cancel
+        message = await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, reply_markup=reply_markup)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_BUDGET_SET_AMOUNT
-    elif user_input == languages[language]['cancel']:
-        cancel(update, context)
+    elif user_input == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
     else:
-        message_text = languages[language]['incorrect_selection']
-        message = context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        message_text = strings(language)['incorrect_selection']
+        message = await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
         context.user_data['last_bot_message_id'] = message.message_id
         return FAMILY_BUDGET_ACTIONS
 
-def family_budget_set_amount(update: Update, context: CallbackContext):
+async def family_budget_set_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     amount = update.message.text
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    if amount == languages[language]['cancel']:
-        cancel(update, context)
+    language = await get_user_language(user_id)
+    if amount == strings(language)['cancel']:
+        await cancel(update, context)
         return ConversationHandler.END
     try:
         amount = float(amount)
         # Set budget for all family members
-        family_id = get_user_family_id(user_id)
-        conn = sqlite3.connect('bot_database.db')
-        c = conn.cursor()
-        c.execute('SELECT user_id FROM users WHERE family_id = ? AND role = ?', (family_id, 'member'))
-        members = c.fetchall()
-        for member in members:
-            set_user_budget(member[0], amount)
-        conn.close()
-        message_text = languages[language]['budget_set']
-        context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        family_id = await get_user_family_id(user_id)
+        count = await set_family_budget(family_id, amount)
+        message_text = strings(language)['budget_set_members'].format(count=count)
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
     except ValueError:
-        message_text = languages[language]['invalid_amount']
-        context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
+        message_text = strings(language)['invalid_amount']
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=message_text)
         return FAMILY_BUDGET_SET_AMOUNT
     # Return to main menu
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
 
-def settings(update: Update, context: CallbackContext):
+async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
-    keyboard = [
-        [InlineKeyboardButton(languages[language]['change_language'], callback_data='change_language')],
-        [InlineKeyboardButton(languages[language]['cancel'], callback_data='cancel')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = languages[language]['select_language']
+    language = await get_user_language(user_id)
+    reply_markup = keyboards(language).settings
+    message_text = strings(language)['select_language']
     chat_id = update.effective_chat.id
-    message = context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+    message = await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
     context.user_data['last_bot_message_id'] = message.message_id
     return SETTINGS_SELECTION
 
-def settings_selection(update: Update, context: CallbackContext):
+async def settings_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
 
     if data == 'change_language':
         # Ask for language selection
-        keyboard = [
-            [InlineKeyboardButton("O'zbekcha", callback_data='lang_uz')],
-            [InlineKeyboardButton("Русский", callback_data='lang_ru')],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message_text = languages[language]['choose_language']
+        reply_markup = LANGUAGE_CHOICE
+        message_text = strings(language)['choose_language']
         chat_id = update.effective_chat.id
-        message = context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+        message = await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
         context.user_data['last_bot_message_id'] = message.message_id
         return LANGUAGE_SELECTION
     elif data == 'cancel':
         delete_previous_bot_message(update, context)
-        show_main_menu(update, context, language)
+        await show_main_menu(update, context, language)
         return ConversationHandler.END
 
-def cancel(update: Update, context: CallbackContext):
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # A CSV or XLSX file of transactions, see transaction_import
+    user_id = update.effective_user.id
+    language = await get_user_language(user_id)
+    chat_id = update.effective_chat.id
+    document = update.message.document
+    if await get_user_role(user_id) == 'member':
+        # Their transactions need the head's approval one by one
+        await context.bot.send_message(chat_id=chat_id, text=strings(language)['import_not_allowed'])
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await context.bot.send_message(chat_id=chat_id, text=strings(language)['import_too_large'])
+        return
+    placeholder = await context.bot.send_message(chat_id=chat_id, text=strings(language)['import_started'])
+    family_id = await get_user_family_id(user_id)
+    try:
+        file = await document.get_file()
+        content = await file.download_as_bytearray()
+        result = await import_transactions(
+            user_id, family_id, language, document.file_name or '', bytes(content)
+        )
+    except Exception as e:
+        logging.error(f"Import of {document.file_name} for {user_id} failed: {e}")
+        await context.bot.edit_message_text(
+            chat_id=chat_id, message_id=placeholder.message_id, text=strings(language)['import_failed']
+        )
+        return
+    for scope in result.scopes:
+        invalidate_scope(scope)
+    message_text = strings(language)['import_done'].format(accepted=result.accepted, rejected=result.rejected)
+    if result.rejected_lines:
+        lines = ', '.join(str(line) for line in result.rejected_lines)
+        message_text += '\n' + strings(language)['import_rejected_lines'].format(lines=lines)
+    if result.stopped_after is not None:
+        message_text += '\n' + strings(language)['import_stopped'].format(line=result.stopped_after)
+    await context.bot.edit_message_text(chat_id=chat_id, message_id=placeholder.message_id, text=message_text)
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     delete_previous_bot_message(update, context)
     delete_user_message(update, context)
     user_id = update.effective_user.id
-    language = get_user_language(user_id)
+    language = await get_user_language(user_id)
     # Send notification and delete after 3 seconds
     chat_id = update.effective_chat.id
-    message_text = languages[language]['operation_cancelled']
-    message = context.bot.send_message(
-        chat_id=chat_id, text=message_text, reply_markup=ReplyKeyboardRemove()
-    )
-    context.job_queue.run_once(
-        delete_message, 3, context={'chat_id': chat_id, 'message_id': message.message_id}
+    message_text = strings(language)['operation_cancelled']
+    message = await context.bot.send_message(
+        chat_id=chat_id, text=message_text, reply_markup=REMOVE_KEYBOARD
     )
+    delete_message_later(context, chat_id, message.message_id)
     # Return to main menu
-    show_main_menu(update, context, language)
+    await show_main_menu(update, context, language)
     return ConversationHandler.END
+
+# Main menu action (see menu_routes) -> handler that starts it
+MENU_HANDLERS = {
+    'income': income_start,
+    'expense': expense_start,
+    'report': report_start,
+    'family_budget': family_budget_start,
+    'settings': settings,
+}
@@ -58,15 +58,29 @@ languages = {
         'reject_expense': "❌ Chiqimni rad etish",
         'expense_approved': "✅ Chiqim tasdiqlandi",
         'expense_rejected': "❌ Chiqim rad etildi",
+        'already_decided': "Bu yozuv bo'yicha qaror allaqachon qabul qilingan.",
         'request_sent': "✅ So'rov yuborildi, oila boshlig'i tasdiqlashini kuting.",
         'set_budget': "💰 Byudjet ajratish",
         'enter_budget_amount': "💰 Byudjet summasini kiriting:",
         'budget_set': "✅ Byudjet ajratildi",
+        'budget_set_members': "✅ Byudjet ajratildi: {count} ta a'zo",
         'insufficient_budget': "❌ Byudjet yetarli emas.",
         'graph_report': "📊 Grafik hisobot",
         'select_graph_type': "Grafik turini tanlang:",
         'income_expense_over_time': "📈 Vaqt bo'yicha kirim/chiqim",
         'category_distribution': "📊 Kategoriya bo'yicha taqsimot",
+        'report_preparing': "⏳ Hisobot tayyorlanmoqda...",
+        'report_busy': "⏳ Hozir hisobotlar ko'p, birozdan so'ng qayta urinib ko'ring.",
+        'report_in_progress': "⏳ Oldingi hisobotingiz hali tayyorlanmoqda.",
+        'import_started': "⏳ Fayl import qilinmoqda...",
+        'import_done': "✅ Import tugadi: {accepted} ta qabul qilindi, {rejected} ta rad etildi.",
+        'import_rejected_lines': "Rad etilgan qatorlar: {lines}",
+        'import_not_allowed': "❌ Oila a'zolari import qila olmaydi, yozuvlarni oila boshlig'i tasdiqlashi kerak.",
+        'import_too_large': "❌ Fayl juda katta.",
+        'import_failed': "❌ Faylni o'qib bo'lmadi. CSV yoki XLSX yuboring: sana, summa, valyuta, bo'lim, kommentariya.",
+        'import_stopped': "⚠️ Faylni {line}-qatordan keyin o'qib bo'lmadi. Shu qatorgacha bo'lganlari saqlandi: faylni qayta yubormang, faqat qolgan qatorlarni yuboring.",
+        'quick_add_help': "Tezkor kiritish: -25000 UZS Oziq-ovqat tushlik (chiqim) yoki +500 USD Oylik maosh (kirim).",
+        'quick_add_unknown_category': "❌ Bo'lim topilmadi. Bo'limlar: {categories}",
     },
     'ru': {
         'start_message_new': "Здравствуйте! 😃 \nВыберите нужный раздел:",
@@ -125,14 +139,28 @@ languages = {
         'reject_expense': "❌ Отклонить расход",
         'expense_approved': "✅ Расход одобрен",
         'expense_rejected': "❌ Расход отклонен",
+        'already_decided': "По этой записи решение уже принято.",
         'request_sent': "✅ Запрос отправлен, ожидайте одобрения главы семьи.",
         'set_budget': "💰 Установить бюджет",
         'enter_budget_amount': "💰 Введите сумму бюджета:",
         'budget_set': "✅ Бюджет установлен",
+        'budget_set_members': "✅ Бюджет установлен для участников: {count}",
         'insufficient_budget': "❌ Недостаточно бюджета.",
         'graph_report': "📊 Графический отчет",
         'select_graph_type': "Выберите тип графика:",
         'income_expense_over_time': "📈 Доходы/Расходы по времени",
         'category_distribution': "📊 Распределение по категориям",
+        'report_preparing': "⏳ Отчет готовится...",
+        'report_busy': "⏳ Сейчас много отчетов, попробуйте чуть позже.",
+        'report_in_progress': "⏳ Ваш предыдущий отчет еще готовится.",
+        'import_started': "⏳ Импортирую файл...",
+        'import_done': "✅ Импорт завершен: принято {accepted}, отклонено {rejected}.",
+        'import_rejected_lines': "Отклоненные строки: {lines}",
+        'import_not_allowed': "❌ Участники семьи не могут импортировать, их записи одобряет глава семьи.",
+        'import_too_large': "❌ Файл слишком большой.",
+        'import_failed': "❌ Не удалось прочитать файл. Отправьте CSV или XLSX: дата, сумма, валюта, категория, комментарий.",
+        'import_stopped': "⚠️ Файл не удалось прочитать после строки {line}. Строки до нее сохранены: не отправляйте файл заново, отправьте только оставшиеся строки.",
+        'quick_add_help': "Быстрый ввод: -25000 UZS Продукты обед (расход) или +500 USD Зарплата (доход).",
+        'quick_add_unknown_category': "❌ Категория не найдена. Категории: {categories}",
     },
 }
@@ -0,0 +1,152 @@
+# localization.py
+
+from types import MappingProxyType
+from typing import NamedTuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from language_data import languages
+from constants import CURRENCIES, DEFAULT_LANGUAGE
+
+# The catalog in language_data is compiled once at import: every language
+# gets all keys (the default language's text where it has none) in a
+# read-only mapping, and the static keyboards are built once per language.
+# Telegram objects are immutable, so one keyboard serves every message.
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _compile(language):
+    texts = {**languages[DEFAULT_LANGUAGE], **languages[language]}
+    return MappingProxyType({key: _freeze(value) for key, value in texts.items()})
+
+
+CATALOGS = MappingProxyType({language: _compile(language) for language in languages})
+
+
+def strings(language):
+    # The language's texts; users who haven't picked one yet get the default
+    catalog = CATALOGS.get(language)
+    if catalog is None:
+        catalog = CATALOGS[DEFAULT_LANGUAGE]
+    return catalog
+
+
+# Transaction table -> catalog key of its categories
+CATEGORY_KEYS = {'incomes': 'income_categories', 'expenses': 'expense_categories'}
+
+
+def _category_names(key):
+    # language -> stored names; every language lists the categories in the
+    # same order, so a position is the same category in all of them
+    return MappingProxyType(
+        {language: tuple(name for _, name in texts[key]) for language, texts in CATALOGS.items()}
+    )
+
+
+def _category_positions(key):
+    # Button label or stored name in any language, casefolded -> position
+    positions = {}
+    for texts in CATALOGS.values():
+        for position, (label, name) in enumerate(texts[key]):
+            positions.setdefault(label.casefold(), position)
+            positions.setdefault(name.casefold(), position)
+    return MappingProxyType(positions)
+
+
+CATEGORY_NAMES = MappingProxyType({table: _category_names(key) for table, key in CATEGORY_KEYS.items()})
+CATEGORY_POSITIONS = MappingProxyType({table: _category_positions(key) for table, key in CATEGORY_KEYS.items()})
+
+
+def category_names(table, language):
+    # The table's stored category names in the language, by position
+    names = CATEGORY_NAMES[table]
+    return names.get(language) or names[DEFAULT_LANGUAGE]
+
+
+def category_name(table, text, language):
+    # A category's label or name in any language -> its stored name in the
+    # language, None if there's no such category
+    position = CATEGORY_POSITIONS[table].get(text.strip().casefold())
+    if position is None:
+        return None
+    return category_names(table, language)[position]
+
+
+class Keyboards(NamedTuple):
+    main_menu: ReplyKeyboardMarkup
+    cancel: ReplyKeyboardMarkup
+    currencies: InlineKeyboardMarkup
+    income_categories: InlineKeyboardMarkup
+    expense_categories: InlineKeyboardMarkup
+    report_periods: InlineKeyboardMarkup
+    graph_types: InlineKeyboardMarkup
+    report_actions: InlineKeyboardMarkup
+    family_head_menu: ReplyKeyboardMarkup
+    family_menu: ReplyKeyboardMarkup
+    settings: InlineKeyboardMarkup
+
+
+# Shown before the user has a language
+LANGUAGE_CHOICE = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("O'zbekcha", callback_data='lang_uz')],
+        [InlineKeyboardButton("Русский", callback_data='lang_ru')],
+    ]
+)
+
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+
+
+def _inline_column(buttons):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=data)] for label, data in buttons])
+
+
+def _build_keyboards(texts):
+    return Keyboards(
+        main_menu=ReplyKeyboardMarkup(
+            [
+                [texts['income'], texts['expense']],
+                [texts['report'], texts['family_budget']],
+                [texts['settings']],
+            ],
+            resize_keyboard=True,
+        ),
+        cancel=ReplyKeyboardMarkup([[texts['cancel']]], resize_keyboard=True),
+        currencies=_inline_column((currency, currency) for currency in CURRENCIES),
+        income_categories=_inline_column(texts['income_categories']),
+        expense_categories=_inline_column(texts['expense_categories']),
+        report_periods=_inline_column(
+            (texts[period], period) for period in ('weekly', 'monthly', 'graph_report')
+        ),
+        graph_types=_inline_column(
+            (texts[graph], graph) for graph in ('income_expense_over_time', 'category_distribution')
+        ),
+        report_actions=InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(texts['view_in_telegram'], callback_data='view_in_telegram'),
+                    InlineKeyboardButton(texts['download'], callback_data='download'),
+                ]
+            ]
+        ),
+        family_head_menu=ReplyKeyboardMarkup(
+            [[texts['set_budget']], [texts['cancel']]], resize_keyboard=True
+        ),
+        family_menu=ReplyKeyboardMarkup(
+            [[texts['register_family']], [texts['join_family']], [texts['cancel']]], resize_keyboard=True
+        ),
+        settings=_inline_column(((texts['change_language'], 'change_language'), (texts['cancel'], 'cancel'))),
+    )
+
+
+KEYBOARDS = MappingProxyType({language: _build_keyboards(catalog) for language, catalog in CATALOGS.items()})
+
+
+def keyboards(language):
+    keyboard_set = KEYBOARDS.get(language)
+    if keyboard_set is None:
+        keyboard_set = KEYBOARDS[DEFAULT_LANGUAGE]
+    return keyboard_set
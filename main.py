@@ -1,7 +1,9 @@
 # main.py
 
+import argparse
+import asyncio
 import logging
-from telegram.ext import Updater, ConversationHandler, CommandHandler, MessageHandler, Filters, CallbackQueryHandler
+from telegram.ext import ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from handlers import (
     start,
     language_selection,
@@ -28,6 +30,8 @@ from handlers import (
     settings_selection,
     cancel,
     family_budget_start, settings,
+    import_document,
+    quick_add,
 )
 from constants import (
     LANGUAGE_SELECTION,
@@ -49,18 +53,22 @@ from constants import (
     FAMILY_BUDGET_SET_AMOUNT,
     SETTINGS_SELECTION,
 )
-from db_functions import init_db
-from constants import TOKEN
-from language_data import languages
+from db_functions import init_db, rebuild_rollups, get_profile_cache_stats
+from constants import METRICS_LOG_INTERVAL, REPORT_WARMUP, WEBHOOK_URL
 from family_budget import handle_approval
+from report_worker import get_metrics, shutdown_report_pool, warm_up_report_pool
+from chart_cache import get_cache_stats
+from webhook import WebhookRunner
+from chat_dispatcher import create_application
+from menu_routes import MenuButton
+from quick_add import QUICK_ADD_PATTERN
+from outbound import get_outbound_stats
 
 logging.basicConfig(level=logging.INFO)
+# httpx logs every Bot API request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
-def main():
-    init_db()
-    updater = Updater(TOKEN, use_context=True)
-    dp = updater.dispatcher
-
+def register_handlers(application):
     # Conversation handler for language selection
     lang_conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -70,54 +78,60 @@ def main():
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='language',
+        persistent=True,
         allow_reentry=True,
     )
 
-    dp.add_handler(lang_conv_handler)
+    application.add_handler(lang_conv_handler)
 
     # Conversation handlers for income
     income_conv_handler = ConversationHandler(
         entry_points=[
             MessageHandler(
-                Filters.regex('^(' + languages['uz']['income'] + '|' + languages['ru']['income'] + ')$'),
+                MenuButton('income'),
                 income_start,
             )
         ],
         states={
-            INCOME_AMOUNT: [MessageHandler(Filters.text & ~Filters.command, income_amount_received)],
+            INCOME_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, income_amount_received)],
             INCOME_CURRENCY: [CallbackQueryHandler(income_currency_received, pattern='.*')],
             INCOME_CATEGORY: [CallbackQueryHandler(income_category_received, pattern='.*')],
-            INCOME_COMMENT: [MessageHandler(Filters.text & ~Filters.command, income_comment_received)],
+            INCOME_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, income_comment_received)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='income',
+        persistent=True,
     )
 
-    dp.add_handler(income_conv_handler)
+    application.add_handler(income_conv_handler)
 
     # Conversation handlers for expense
     expense_conv_handler = ConversationHandler(
         entry_points=[
             MessageHandler(
-                Filters.regex('^(' + languages['uz']['expense'] + '|' + languages['ru']['expense'] + ')$'),
+                MenuButton('expense'),
                 expense_start,
             )
         ],
         states={
-            EXPENSE_AMOUNT: [MessageHandler(Filters.text & ~Filters.command, expense_amount_received)],
+            EXPENSE_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, expense_amount_received)],
             EXPENSE_CURRENCY: [CallbackQueryHandler(expense_currency_received, pattern='.*')],
             EXPENSE_CATEGORY: [CallbackQueryHandler(expense_category_received, pattern='.*')],
-            EXPENSE_COMMENT: [MessageHandler(Filters.text & ~Filters.command, expense_comment_received)],
+            EXPENSE_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, expense_comment_received)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='expense',
+        persistent=True,
     )
 
-    dp.add_handler(expense_conv_handler)
+    application.add_handler(expense_conv_handler)
 
     # Conversation handler for report
     report_conv_handler = ConversationHandler(
         entry_points=[
             MessageHandler(
-                Filters.regex('^(' + languages['uz']['report'] + '|' + languages['ru']['report'] + ')$'),
+                MenuButton('report'),
                 report_start,
             )
         ],
@@ -127,35 +141,39 @@ def main():
             GRAPH_REPORT_SELECTION: [CallbackQueryHandler(graph_report_selection, pattern='.*')],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='report',
+        persistent=True,
     )
 
-    dp.add_handler(report_conv_handler)
+    application.add_handler(report_conv_handler)
 
     # Conversation handler for family budget
     family_budget_conv_handler = ConversationHandler(
         entry_points=[
             MessageHandler(
-                Filters.regex('^(' + languages['uz']['family_budget'] + '|' + languages['ru']['family_budget'] + ')$'),
+                MenuButton('family_budget'),
                 family_budget_start,
             )
         ],
         states={
-            FAMILY_BUDGET_MENU: [MessageHandler(Filters.text & ~Filters.command, family_budget_menu_selection)],
-            FAMILY_CREATE: [MessageHandler(Filters.text & ~Filters.command, family_create)],
-            FAMILY_JOIN: [MessageHandler(Filters.text & ~Filters.command, family_join)],
-            FAMILY_BUDGET_ACTIONS: [MessageHandler(Filters.text & ~Filters.command, family_budget_actions)],
-            FAMILY_BUDGET_SET_AMOUNT: [MessageHandler(Filters.text & ~Filters.command, family_budget_set_amount)],
+            FAMILY_BUDGET_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, family_budget_menu_selection)],
+            FAMILY_CREATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, family_create)],
+            FAMILY_JOIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, family_join)],
+            FAMILY_BUDGET_ACTIONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, family_budget_actions)],
+            FAMILY_BUDGET_SET_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, family_budget_set_amount)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='family_budget',
+        persistent=True,
     )
 
-    dp.add_handler(family_budget_conv_handler)
+    application.add_handler(family_budget_conv_handler)
 
     # Conversation handler for settings
     settings_conv_handler = ConversationHandler(
         entry_points=[
             MessageHandler(
-                Filters.regex('^(' + languages['uz']['settings'] + '|' + languages['ru']['settings'] + ')$'),
+                MenuButton('settings'),
                 settings,
             )
         ],
@@ -166,19 +184,86 @@ def main():
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='settings',
+        persistent=True,
     )
 
-    dp.add_handler(settings_conv_handler)
+    application.add_handler(settings_conv_handler)
+
+    # Transactions imported from a CSV/XLSX file
+    application.add_handler(
+        MessageHandler(filters.Document.FileExtension('csv') | filters.Document.FileExtension('xlsx'), import_document)
+    )
+
+    # One-line transactions, e.g. "-25000 UZS Oziq-ovqat tushlik"
+    application.add_handler(MessageHandler(filters.Regex(QUICK_ADD_PATTERN) & ~filters.COMMAND, quick_add))
 
     # Handler for main menu selections
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, main_menu_selection))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_selection))
 
     # Handler for approvals
-    dp.add_handler(CallbackQueryHandler(handle_approval, pattern='^(approve|reject)_.*'))
+    application.add_handler(CallbackQueryHandler(handle_approval, pattern='^(approve|reject)_.*'))
+
+# Tasks started in post_init, cancelled on shutdown
+_background_tasks = []
+
+def log_metrics():
+    logging.info(f"Report workers: {get_metrics()}")
+    logging.info(f"Chart cache: {get_cache_stats()}")
+    logging.info(f"Profile cache: {get_profile_cache_stats()}")
+    logging.info(f"Outbound: {get_outbound_stats()}")
+
+async def log_metrics_periodically():
+    while True:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        log_metrics()
 
-    # Start the bot
-    updater.start_polling()
-    updater.idle()
+async def warm_up_when_running(application):
+    # post_init runs before polling (or the webhook server) starts; the
+    # application is running once updates are being received
+    while not application.running:
+        await asyncio.sleep(0.1)
+    warm_up_report_pool()
+
+async def on_startup(application):
+    # Plain tasks rather than application.create_task(), which the
+    # application waits for when it stops
+    if REPORT_WARMUP:
+        _background_tasks.append(asyncio.create_task(warm_up_when_running(application)))
+    if METRICS_LOG_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(log_metrics_periodically()))
+
+async def on_shutdown(application):
+    for task in _background_tasks:
+        task.cancel()
+    # Waits for renders in progress without blocking the event loop
+    await asyncio.to_thread(shutdown_report_pool)
+    log_metrics()
+
+def main():
+    init_db()
+    application = create_application(post_init=on_startup, post_shutdown=on_shutdown)
+    register_handlers(application)
+
+    # Start the bot, until SIGINT/SIGTERM
+    if WEBHOOK_URL:
+        WebhookRunner(application).run()
+    else:
+        application.run_polling()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Family budget Telegram bot')
+    parser.add_argument(
+        '--rebuild-rollups',
+        action='store_true',
+        help='recompute the daily_totals report rollups from incomes/expenses and exit',
+    )
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.rebuild_rollups:
+        init_db()
+        rebuild_rollups()
+    else:
+        main()
@@ -0,0 +1,40 @@
+# menu_routes.py
+
+from telegram.ext import filters
+from localization import CATALOGS
+
+# Main menu buttons, by their key in the localization catalog
+MENU_ACTIONS = ('income', 'expense', 'report', 'family_budget', 'settings')
+
+
+def build_routes(actions):
+    # Button label in any language -> action; labels are compared as they
+    # are, so none of their characters need escaping
+    routes = {}
+    for language, texts in CATALOGS.items():
+        for action in actions:
+            label = texts[action]
+            if routes.setdefault(label, action) != action:
+                raise ValueError(f"Button label {label!r} ({language}) is used for two actions")
+    return routes
+
+
+MENU_ROUTES = build_routes(MENU_ACTIONS)
+
+
+def route_menu(text):
+    # The main menu action of a button label, or None
+    return MENU_ROUTES.get(text)
+
+
+class MenuButton(filters.MessageFilter):
+    # Matches text messages that are the given main menu button, in any language
+
+    def __init__(self, action):
+        if action not in MENU_ACTIONS:
+            raise ValueError(f"Unknown menu action {action!r}")
+        super().__init__(name=f'MenuButton({action})')
+        self.action = action
+
+    def filter(self, message):
+        return MENU_ROUTES.get(message.text) == self.action
@@ -0,0 +1,169 @@
+# outbound.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from cachetools import TTLCache
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+from constants import (
+    OUTBOUND_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_GROUP_RATE,
+    DELETE_BATCH_WINDOW,
+)
+
+# Lower goes first when calls wait for the overall limit
+PRIORITY_REPLY = 0
+PRIORITY_CLEANUP = 1
+
+CLEANUP_ENDPOINTS = {'deleteMessage', 'deleteMessages'}
+
+# Attempts after Telegram answers 429 Too Many Requests
+MAX_RETRIES = 3
+
+# deleteMessages takes at most this many ids
+DELETE_BATCH_SIZE = 100
+
+_stats = {'calls': 0, 'delayed': 0, 'flood_waits': 0, 'deleted': 0, 'delete_calls': 0}
+
+
+class TokenBucket:
+    # rate tokens per second, at most burst saved up. reserve() takes a token
+    # even before it is there and returns how long to wait for it, so callers
+    # go in the order they reserved.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class OutboundLimiter(BaseRateLimiter):
+    # Every Bot API call except getUpdates passes through here. Replies to a
+    # chat first wait for that chat's bucket; everything sent to a chat then
+    # shares the overall bucket, replies ahead of cleanup. Calls without a
+    # chat (callback answers, getMe, setWebhook) are not held back. A 429
+    # pauses all calls for retry_after, then the call is retried.
+
+    def __init__(self):
+        self._bucket = TokenBucket(OUTBOUND_RATE, OUTBOUND_RATE)
+        # An idle chat's bucket is full again well within a minute
+        self._chats = TTLCache(maxsize=100000, ttl=60)
+        # (priority, arrival, future) of calls waiting for the overall bucket
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._releaser = None
+        self._paused_until = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._releaser is not None:
+            self._releaser.cancel()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        _stats['calls'] += 1
+        priority = PRIORITY_CLEANUP if endpoint in CLEANUP_ENDPOINTS else PRIORITY_REPLY
+        if priority == PRIORITY_REPLY:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                _stats['delayed'] += 1
+                await asyncio.sleep(delay)
+        for attempt in range(MAX_RETRIES + 1):
+            await self._acquire(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                _stats['flood_waits'] += 1
+                logging.warning(f"Bot API flood limit on {endpoint}, pausing for {e.retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = OUTBOUND_GROUP_RATE if group else OUTBOUND_CHAT_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate, OUTBOUND_CHAT_BURST)
+        return bucket
+
+    async def _acquire(self, priority):
+        if not self._waiting and time.monotonic() >= self._paused_until and not self._bucket.wait_time():
+            self._bucket.reserve()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._arrivals), future))
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.create_task(self._release())
+        await future
+
+    async def _release(self):
+        # Hands out the overall bucket's tokens, by priority then arrival
+        while self._waiting:
+            delay = max(self._bucket.wait_time(), self._paused_until - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self._bucket.reserve()
+                future.set_result(None)
+
+
+# chat_id -> message ids to delete in the chat's next deleteMessages call
+_pending_deletions = {}
+
+
+def delete_soon(application, chat_id, message_id, delay=0):
+    # Deletes the message after delay seconds, in one call with the chat's
+    # other deletions of the next DELETE_BATCH_WINDOW. Application.stop()
+    # waits for it.
+    application.create_task(_delete(application.bot, chat_id, message_id, delay))
+
+
+async def _delete(bot, chat_id, message_id, delay):
+    if delay:
+        await asyncio.sleep(delay)
+    message_ids = _pending_deletions.get(chat_id)
+    if message_ids is not None:
+        # The chat's batch is still collecting
+        message_ids.append(message_id)
+        return
+    message_ids = _pending_deletions[chat_id] = [message_id]
+    await asyncio.sleep(DELETE_BATCH_WINDOW)
+    del _pending_deletions[chat_id]
+    _stats['deleted'] += len(message_ids)
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        _stats['delete_calls'] += 1
+        try:
+            await bot.delete_messages(chat_id, message_ids[start:start + DELETE_BATCH_SIZE])
+        except TelegramError as e:
+            logging.warning(f"Failed to delete messages: {e}")
+
+
+def get_outbound_stats():
+    return dict(_stats)
@@ -0,0 +1,112 @@
+# persistence.py
+
+import asyncio
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+from async_db import run_db
+from db_functions import load_user_state, load_conversation_states, save_bot_state
+from constants import STATE_FLUSH_INTERVAL
+
+
+class SQLitePersistence(BasePersistence):
+    # Keeps user_data and the ConversationHandler states in the bot's
+    # database. The application hands over what changed every
+    # STATE_FLUSH_INTERVAL seconds and once more when it stops; all of it is
+    # written in one transaction. user_data is read on a user's first update
+    # after a start, conversation states (a row per unfinished flow) up front.
+
+    def __init__(self, update_interval=STATE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded_users = set()
+        # Changes not written yet, None deletes
+        self._user_data = {}
+        self._conversations = {}
+        self._writer = None
+
+    async def get_user_data(self):
+        # Nothing up front, refresh_user_data() loads each user's on first use
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        stored = await run_db(load_user_state, user_id)
+        for key, value in stored.items():
+            # Anything set since the start is newer
+            user_data.setdefault(key, value)
+        self._loaded_users.add(user_id)
+
+    async def update_user_data(self, user_id, data):
+        if user_id not in self._loaded_users:
+            # No handler ran for the update, so the stored data was never
+            # read and this empty dict must not replace it
+            return
+        self._user_data[user_id] = data
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._user_data[user_id] = None
+        self._schedule_write()
+
+    async def get_conversations(self, name):
+        return await run_db(load_conversation_states, name)
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversations[name, key] = new_state
+        self._schedule_write()
+
+    def _schedule_write(self):
+        # The application updates every changed user at once, one write
+        # picks them all up
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while self._user_data or self._conversations:
+            user_data, self._user_data = self._user_data, {}
+            conversations, self._conversations = self._conversations, {}
+            try:
+                await run_db(save_bot_state, user_data, conversations)
+            except Exception as e:
+                logging.error(f"Failed to save bot state: {e}")
+                # Keep it for the next write, unless something newer came in
+                self._user_data = {**user_data, **self._user_data}
+                self._conversations = {**conversations, **self._conversations}
+                return
+
+    async def flush(self):
+        if self._writer is not None:
+            await self._writer
+        await self._write()
+
+    # Not stored
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,80 @@
+# quick_add.py
+#
+# One-line transactions typed in chat instead of the step by step flow:
+# "-25000 UZS Oziq-ovqat tushlik" is an expense, "+500 USD Oylik maosh" an
+# income. The category is any category of the bot in either language (its
+# button label or name, any case, or the unique start of a name) and is
+# stored under its name in the user's language; what follows it is the
+# comment.
+
+from typing import NamedTuple
+from transaction_import import CURRENCY_CODES, parse_amount
+from localization import CATEGORY_NAMES, CATEGORY_POSITIONS, category_names
+
+# Messages the quick-add handler looks at: a sign, then the amount
+QUICK_ADD_PATTERN = r'^\s*[+-]\s*\d'
+
+# Shortest start of a category name that is recognised
+MIN_PREFIX_LENGTH = 3
+
+class QuickEntry(NamedTuple):
+    # 'income' or 'expense'
+    kind: str
+    amount: float
+    currency: str
+    category: str
+    comment: str
+
+
+class UnknownCategory(ValueError):
+    def __init__(self, kind):
+        super().__init__(f"Unknown {kind} category")
+        self.kind = kind
+
+
+def _prefix_matches(names, start):
+    return {position for position, name in enumerate(names) if name.casefold().startswith(start)}
+
+
+def _resolve_category(table, words, language):
+    # (category in the language, words left for the comment); the longest
+    # run of leading words that names a category wins, e.g. "Dam olish" over
+    # "Dam"
+    all_names = CATEGORY_NAMES[table]
+    names = category_names(table, language)
+    positions = CATEGORY_POSITIONS[table]
+    for count in range(len(words), 0, -1):
+        position = positions.get(' '.join(words[:count]).casefold())
+        if position is not None:
+            return names[position], words[count:]
+    if words and len(words[0]) >= MIN_PREFIX_LENGTH:
+        start = words[0].casefold()
+        # The language's own names first, the others only if none match
+        matches = _prefix_matches(names, start)
+        if not matches:
+            for other_names in all_names.values():
+                matches |= _prefix_matches(other_names, start)
+        if len(matches) == 1:
+            return names[matches.pop()], words[1:]
+    return None, words
+
+
+def parse_quick_add(text, language):
+    # QuickEntry with the category named in the user's language, or
+    # ValueError (UnknownCategory when only the category is wrong)
+    text = text.strip()
+    sign, text = text[:1], text[1:].split()
+    if sign not in '+-' or len(text) < 3:
+        raise ValueError("Expected: sign, amount, currency, category")
+    amount_text, currency, *words = text
+    amount = parse_amount(amount_text)
+    if amount < 0:
+        raise ValueError("The sign goes before the amount")
+    currency = currency.upper()
+    if currency not in CURRENCY_CODES:
+        raise ValueError(f"Unknown currency {currency!r}")
+    kind, table = ('expense', 'expenses') if sign == '-' else ('income', 'incomes')
+    category, comment_words = _resolve_category(table, words, language)
+    if category is None:
+        raise UnknownCategory(kind)
+    return QuickEntry(kind, amount, currency, category, ' '.join(comment_words))
@@ -0,0 +1,129 @@
+# report_data.py
+
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+from db_functions import ROLLUP_KINDS, read_snapshot
+
+PERIOD_DAYS = {'weekly': 7, 'monthly': 30}
+
+# Detail rows are fetched from SQLite this many at a time
+ROW_PAGE_SIZE = 1000
+
+# Column order of detail rows
+ROW_COLUMNS = ['date', 'amount', 'currency', 'category', 'comment']
+
+# SQL expressions reports can be totalled by: (daily_totals, transaction rows)
+GROUP_BY = {
+    'currency': ('currency', 'currency'),
+    'category': ('category', 'category'),
+    'month': ('substr(day, 1, 7)', "strftime('%Y-%m', date)"),
+}
+
+
+class ReportData(NamedTuple):
+    scope: tuple            # ('family_id', id) or ('user_id', id)
+    since: str              # period start, None for the whole history
+    income_totals: dict     # group key -> total, ordered by key
+    expense_totals: dict
+    income_rows: object     # iterator of ROW_COLUMNS tuples ordered by date, empty unless requested
+    expense_rows: object
+
+
+def get_period_start(period):
+    # Same text format sqlite3 stores datetimes in, so the comparison
+    # can use the (scope, approved, date) indexes
+    return (datetime.now() - timedelta(days=PERIOD_DAYS[period])).isoformat(' ')
+
+
+def _scope_filter(scope, since):
+    scope_column, scope_id = scope
+    where = f'{scope_column} = ? AND approved = 1'
+    params = [scope_id]
+    if since is not None:
+        where += ' AND date >= ?'
+        params.append(since)
+    return where, params
+
+
+def _totals_query(scope, since, group_by):
+    # Whole days come from daily_totals. The period usually starts mid-day,
+    # so the rows of that first day are summed directly to keep the window exact.
+    rollup_key, row_key = GROUP_BY[group_by]
+    parts = [
+        f'SELECT kind, {rollup_key} AS key, total AS amount, remainder FROM daily_totals '
+        f'WHERE scope_type = ? AND scope_id = ?'
+    ]
+    params = list(scope)
+    if since is not None:
+        next_day = (date.fromisoformat(since[:10]) + timedelta(days=1)).isoformat()
+        parts[0] += ' AND day >= ?'
+        params.append(next_day)
+        where, row_params = _scope_filter(scope, since)
+        for table, kind in ROLLUP_KINDS.items():
+            parts.append(f'SELECT {kind}, {row_key}, amount, 0.0 FROM {table} WHERE {where} AND date < ?')
+            params += row_params + [next_day]
+    query = (
+        f'SELECT kind, key, exact_sum(amount, remainder) FROM ({" UNION ALL ".join(parts)}) '
+        f"WHERE key IS NOT NULL AND key != '' AND amount IS NOT NULL "
+        f'GROUP BY kind, key ORDER BY kind, key'
+    )
+    return query, params
+
+
+def _iter_rows(cursor, table, scope, since):
+    # Pages through the cursor so only ROW_PAGE_SIZE rows are in memory
+    where, params = _scope_filter(scope, since)
+    cursor.execute(
+        f'SELECT date, amount, currency, category, comment FROM {table} '
+        f'WHERE {where} AND amount IS NOT NULL ORDER BY date, id',
+        params,
+    )
+    while True:
+        page = cursor.fetchmany(ROW_PAGE_SIZE)
+        if not page:
+            return
+        yield from page
+
+
+def _get_scope(c, user_id):
+    c.execute('SELECT family_id FROM users WHERE user_id = ?', (user_id,))
+    result = c.fetchone()
+    # Family members see the whole family's transactions
+    return ('family_id', result[0]) if result and result[0] else ('user_id', user_id)
+
+
+def get_data_version(user_id):
+    # (scope, version) of the data the user's reports are built from; the
+    # version changes whenever an approved transaction in the scope does
+    with read_snapshot() as c:
+        scope = _get_scope(c, user_id)
+        c.execute('SELECT version FROM scope_versions WHERE scope_type = ? AND scope_id = ?', scope)
+        result = c.fetchone()
+    return scope, result[0] if result else 0
+
+
+@contextmanager
+def open_report_data(user_id, period=None, group_by='currency', with_rows=False):
+    # Income and expense for the user's scope, read in one snapshot. Detail
+    # rows are streamed and can only be iterated inside the with block.
+    since = get_period_start(period) if period else None
+    with read_snapshot() as c:
+        scope = _get_scope(c, user_id)
+        c.execute(*_totals_query(scope, since, group_by))
+        totals = ({}, {})
+        for kind, key, total in c.fetchall():
+            totals[kind][key] = total
+
+        rows = (iter(()), iter(()))
+        if with_rows:
+            rows = tuple(
+                _iter_rows(c.connection.cursor(), table, scope, since) for table in ROLLUP_KINDS
+            )
+        yield ReportData(scope, since, totals[0], totals[1], rows[0], rows[1])
+
+
+def load_report_data(user_id, period=None, group_by='currency'):
+    # Totals only
+    with open_report_data(user_id, period, group_by) as data:
+        return data
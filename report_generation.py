@@ -1,47 +1,53 @@
 # report_generation.py
 
-import os
-import matplotlib
-matplotlib.use('Agg')
-import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from report_data import PERIOD_DAYS, load_report_data, open_report_data
 from datetime import datetime
-import sqlite3
-from db_functions import get_user_family_id, get_user_language
 from io import BytesIO
+import itertools
 import logging
-
-
-
-def create_report(user_id, period, language):
-    conn = sqlite3.connect('bot_database.db')
-    family_id = get_user_family_id(user_id)
-    if family_id:
-        # Get data for the family
-        df_income = pd.read_sql_query(
-            'SELECT * FROM incomes WHERE family_id = ? AND approved = 1', conn, params=(family_id,)
-        )
-        df_expense = pd.read_sql_query(
-            'SELECT * FROM expenses WHERE family_id = ? AND approved = 1', conn, params=(family_id,)
-        )
-    else:
-        # Get data for the individual
-        df_income = pd.read_sql_query(
-            'SELECT * FROM incomes WHERE user_id = ? AND approved = 1', conn, params=(user_id,)
-        )
-        df_expense = pd.read_sql_query(
-            'SELECT * FROM expenses WHERE user_id = ? AND approved = 1', conn, params=(user_id,)
-        )
-    conn.close()
-
+import tempfile
+
+# Localized sheet and column names of the Excel report
+EXCEL_LABELS = {
+    'uz': {
+        'totals_sheet': 'Umumiy Hisobot',
+        'income_sheet': 'Kirimlar',
+        'expense_sheet': 'Chiqimlar',
+        'totals_columns': ['Valyuta', 'Umumiy Kirim', 'Umumiy Chiqim', 'Balans'],
+        'columns': ['Sana', 'Summa', 'Valyuta', 'Bo\'lim', 'Kommentariya'],
+    },
+    'ru': {
+        'totals_sheet': 'Общий Отчет',
+        'income_sheet': 'Доходы',
+        'expense_sheet': 'Расходы',
+        'totals_columns': ['Валюта', 'Общий Доход', 'Общий Расход', 'Баланс'],
+        'columns': ['Дата', 'Сумма', 'Валюта', 'Категория', 'Комментарий'],
+    },
+}
+
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+
+# Excel reports larger than this spill from memory to a temporary file
+REPORT_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def create_report(user_id, period, language, output=None):
+    # (output, file_name) with the workbook written to output, by default a
+    # spooled temporary file, and rewound; None without data
     if period == 'weekly':
-        date_filter = datetime.now() - pd.Timedelta(days=7)
         if language == 'uz':
             file_name = 'Haftalik-hisobot.xlsx'
         else:
             file_name = 'Еженедельный-отчет.xlsx'
     elif period == 'monthly':
-        date_filter = datetime.now() - pd.Timedelta(days=30)
         if language == 'uz':
             file_name = 'Oylik-hisobot.xlsx'
         else:
@@ -50,211 +56,97 @@ def create_report(user_id, period, language):
         logging.error("Invalid period specified.")
         return None
 
-    # Convert 'date' columns to datetime
-    df_income['date'] = pd.to_datetime(df_income['date'])
-    df_expense['date'] = pd.to_datetime(df_expense['date'])
-
-    # Filter data based on date
-    recent_income = df_income[df_income['date'] >= date_filter]
-    recent_expense = df_expense[df_expense['date'] >= date_filter]
-
-    if recent_income.empty and recent_expense.empty:
-        # No data to generate report
-        return None
-
-    # Convert 'amount' column to numeric
-    recent_income['amount'] = pd.to_numeric(recent_income['amount'], errors='coerce')
-    recent_expense['amount'] = pd.to_numeric(recent_expense['amount'], errors='coerce')
-
-    # Drop rows with NaN amounts
-    recent_income = recent_income.dropna(subset=['amount'])
-    recent_expense = recent_expense.dropna(subset=['amount'])
-
-    # Remove 'id' and 'user_id' columns
-    recent_income = recent_income.drop(columns=['id', 'user_id', 'family_id', 'approved'])
-    recent_expense = recent_expense.drop(columns=['id', 'user_id', 'family_id', 'approved'])
-
-    # Translate column names
-    if language == 'uz':
-        recent_income.rename(
-            columns={
-                'date': 'Sana',
-                'amount': 'Summa',
-                'currency': 'Valyuta',
-                'category': 'Bo\'lim',
-                'comment': 'Kommentariya',
-            },
-            inplace=True,
-        )
-        recent_expense.rename(
-            columns={
-                'date': 'Sana',
-                'amount': 'Summa',
-                'currency': 'Valyuta',
-                'category': 'Bo\'lim',
-                'comment': 'Kommentariya',
-            },
-            inplace=True,
-        )
-    else:
-        recent_income.rename(
-            columns={
-                'date': 'Дата',
-                'amount': 'Сумма',
-                'currency': 'Валюта',
-                'category': 'Категория',
-                'comment': 'Комментарий',
-            },
-            inplace=True,
-        )
-        recent_expense.rename(
-            columns={
-                'date': 'Дата',
-                'amount': 'Сумма',
-                'currency': 'Валюта',
-                'category': 'Категория',
-                'comment': 'Комментарий',
-            },
-            inplace=True,
-        )
-
-    # Calculate total amounts by currency
-    if language == 'uz':
-        income_total = recent_income.groupby('Valyuta')['Summa'].sum().reset_index()
-        expense_total = recent_expense.groupby('Valyuta')['Summa'].sum().reset_index()
-    else:
-        income_total = recent_income.groupby('Валюта')['Сумма'].sum().reset_index()
-        expense_total = recent_expense.groupby('Валюта')['Сумма'].sum().reset_index()
-
-    # Create total report dataframe
-    if language == 'uz':
-        total_df = pd.merge(
-            income_total,
-            expense_total,
-            on='Valyuta',
-            how='outer',
-            suffixes=('_Kirim', '_Chiqim'),
-        ).fillna(0)
-        total_df['Balans'] = total_df['Summa_Kirim'] - total_df['Summa_Chiqim']
-        # Rename columns
-        total_df.rename(
-            columns={
-                'Valyuta': 'Valyuta',
-                'Summa_Kirim': 'Umumiy Kirim',
-                'Summa_Chiqim': 'Umumiy Chiqim',
-                'Balans': 'Balans',
-            },
-            inplace=True,
-        )
-    else:
-        total_df = pd.merge(
-            income_total,
-            expense_total,
-            on='Валюта',
-            how='outer',
-            suffixes=('_Доход', '_Расход'),
-        ).fillna(0)
-        total_df['Баланс'] = total_df['Сумма_Доход'] - total_df['Сумма_Расход']
-        # Rename columns
-        total_df.rename(
-            columns={
-                'Валюта': 'Валюта',
-                'Сумма_Доход': 'Общий Доход',
-                'Сумма_Расход': 'Общий Расход',
-                'Баланс': 'Баланс',
-            },
-            inplace=True,
-        )
+    labels = EXCEL_LABELS['uz' if language == 'uz' else 'ru']
+    # Rows are paged from SQLite straight into a write-only workbook, so
+    # memory use doesn't grow with the number of transactions
+    with open_report_data(user_id, period, with_rows=True) as data:
+        if not data.income_totals and not data.expense_totals:
+            # No data to generate report
+            return None
 
-    with pd.ExcelWriter(file_name, engine='openpyxl') as writer:
+        workbook = Workbook(write_only=True)
         # Write total amounts
-        if not total_df.empty:
-            total_df.to_excel(
-                writer, sheet_name='Umumiy Hisobot' if language == 'uz' else 'Общий Отчет', index=False
-            )
+        totals_sheet = workbook.create_sheet(labels['totals_sheet'])
+        totals_sheet.append(header_cells(totals_sheet, labels['totals_columns']))
+        for currency in sorted(set(data.income_totals).union(data.expense_totals)):
+            income_sum = data.income_totals.get(currency, 0.0)
+            expense_sum = data.expense_totals.get(currency, 0.0)
+            totals_sheet.append([currency, income_sum, expense_sum, income_sum - expense_sum])
         # Write detailed data
-        if not recent_income.empty:
-            recent_income.to_excel(
-                writer, sheet_name='Kirimlar' if language == 'uz' else 'Доходы', index=False
-            )
-        if not recent_expense.empty:
-            recent_expense.to_excel(
-                writer, sheet_name='Chiqimlar' if language == 'uz' else 'Расходы', index=False
-            )
-
-    return file_name
+        write_rows_sheet(workbook, labels['income_sheet'], labels['columns'], data.income_rows)
+        write_rows_sheet(workbook, labels['expense_sheet'], labels['columns'], data.expense_rows)
+        if output is None:
+            # In memory unless the workbook grows past REPORT_SPOOL_SIZE, then a
+            # private temporary file; either way nothing is left in the working directory
+            output = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE)
+        workbook.save(output)
+
+    output.seek(0)
+    return output, file_name
+
+
+def header_cells(sheet, columns):
+    # Same header style pandas' to_excel uses
+    cells = []
+    for column in columns:
+        cell = WriteOnlyCell(sheet, value=column)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        cells.append(cell)
+    return cells
+
+
+def write_rows_sheet(workbook, sheet_name, columns, rows):
+    first_row = next(rows, None)
+    if first_row is None:
+        # No sheet for an empty list
+        return
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(header_cells(sheet, columns))
+    for date, amount, currency, category, comment in itertools.chain([first_row], rows):
+        date_cell = WriteOnlyCell(sheet, value=datetime.fromisoformat(date) if date else None)
+        date_cell.number_format = DATETIME_FORMAT
+        sheet.append([date_cell, amount, currency, category, comment])
 
 
 def create_text_report(user_id, period, language):
-    conn = sqlite3.connect('bot_database.db')
-    family_id = get_user_family_id(user_id)
-    if family_id:
-        df_income = pd.read_sql_query(
-            'SELECT * FROM incomes WHERE family_id = ? AND approved = 1', conn, params=(family_id,)
-        )
-        df_expense = pd.read_sql_query(
-            'SELECT * FROM expenses WHERE family_id = ? AND approved = 1', conn, params=(family_id,)
-        )
-    else:
-        df_income = pd.read_sql_query(
-            'SELECT * FROM incomes WHERE user_id = ? AND approved = 1', conn, params=(user_id,)
-        )
-        df_expense = pd.read_sql_query(
-            'SELECT * FROM expenses WHERE user_id = ? AND approved = 1', conn, params=(user_id,)
-        )
-    conn.close()
-
-    if period == 'weekly':
-        date_filter = datetime.now() - pd.Timedelta(days=7)
-    elif period == 'monthly':
-        date_filter = datetime.now() - pd.Timedelta(days=30)
-    else:
+    if period not in PERIOD_DAYS:
         logging.error("Invalid period specified.")
         return None
 
-    # Convert 'date' columns to datetime
-    df_income['date'] = pd.to_datetime(df_income['date'])
-    df_expense['date'] = pd.to_datetime(df_expense['date'])
-
-    # Filter data based on date
-    recent_income = df_income[df_income['date'] >= date_filter]
-    recent_expense = df_expense[df_expense['date'] >= date_filter]
+    # Totals by currency are computed in SQL over the period only
+    data = load_report_data(user_id, period)
+    income_total = data.income_totals
+    expense_total = data.expense_totals
 
-    if recent_income.empty and recent_expense.empty:
+    if not income_total and not expense_total:
         # No data to generate report
         return None
 
-    # Convert 'amount' column to numeric
-    recent_income['amount'] = pd.to_numeric(recent_income['amount'], errors='coerce')
-    recent_expense['amount'] = pd.to_numeric(recent_expense['amount'], errors='coerce')
-
-    # Drop rows with NaN amounts
-    recent_income = recent_income.dropna(subset=['amount'])
-    recent_expense = recent_expense.dropna(subset=['amount'])
+    # A side without any rows prints 0, a missing currency on the other side 0.0
+    income_missing = 0.0 if income_total else 0
+    expense_missing = 0.0 if expense_total else 0
 
     # Prepare text report
     report_lines = []
 
     # Total amounts
     if language == 'uz':
-        income_total = recent_income.groupby('currency')['amount'].sum().reset_index()
-        expense_total = recent_expense.groupby('currency')['amount'].sum().reset_index()
         report_lines.append('📊 Umumiy Hisobot:')
-        for currency in set(income_total['currency']).union(expense_total['currency']):
-            income_sum = income_total[income_total['currency'] == currency]['amount'].sum()
-            expense_sum = expense_total[expense_total['currency'] == currency]['amount'].sum()
+        for currency in set(income_total).union(expense_total):
+            income_sum = income_total.get(currency, income_missing)
+            expense_sum = expense_total.get(currency, expense_missing)
             balance = income_sum - expense_sum
             report_lines.append(f"💰 Valyuta: {currency}")
             report_lines.append(f"   ➕ Kirim: {income_sum}")
             report_lines.append(f"   ➖ Chiqim: {expense_sum}")
             report_lines.append(f"   💵 Balans: {balance}")
     else:
-        income_total = recent_income.groupby('currency')['amount'].sum().reset_index()
-        expense_total = recent_expense.groupby('currency')['amount'].sum().reset_index()
         report_lines.append('📊 Общий Отчет:')
-        for currency in set(income_total['currency']).union(expense_total['currency']):
-            income_sum = income_total[income_total['currency'] == currency]['amount'].sum()
-            expense_sum = expense_total[expense_total['currency'] == currency]['amount'].sum()
+        for currency in set(income_total).union(expense_total):
+            income_sum = income_total.get(currency, income_missing)
+            expense_sum = expense_total.get(currency, expense_missing)
             balance = income_sum - expense_sum
             report_lines.append(f"💰 Валюта: {currency}")
             report_lines.append(f"   ➕ Доход: {income_sum}")
@@ -267,62 +159,45 @@ def create_text_report(user_id, period, language):
     return '\n'.join(report_lines)
 
 
-def create_graph_report(user_id, graph_type, language):
-    conn = sqlite3.connect('bot_database.db')
-    family_id = get_user_family_id(user_id)
-    if family_id:
-        df_income = pd.read_sql_query(
-            'SELECT * FROM incomes WHERE family_id = ? AND approved = 1', conn, params=(family_id,)
-        )
-        df_expense = pd.read_sql_query(
-            'SELECT * FROM expenses WHERE family_id = ? AND approved = 1', conn, params=(family_id,)
-        )
-    else:
-        df_income = pd.read_sql_query(
-            'SELECT * FROM incomes WHERE user_id = ? AND approved = 1', conn, params=(user_id,)
-        )
-        df_expense = pd.read_sql_query(
-            'SELECT * FROM expenses WHERE user_id = ? AND approved = 1', conn, params=(user_id,)
-        )
-    conn.close()
+def render_png(figure):
+    # Figures are drawn on their own Agg canvas; nothing goes through pyplot's
+    # global state, so renders can run side by side
+    FigureCanvasAgg(figure)
+    figure.tight_layout()
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png')
+    buffer.seek(0)
+    return buffer
 
-    # Convert 'date' columns to datetime
-    df_income['date'] = pd.to_datetime(df_income['date'])
-    df_expense['date'] = pd.to_datetime(df_expense['date'])
 
+def create_graph_report(user_id, graph_type, language):
     if graph_type == 'income_expense_over_time':
         # Group by month
-        df_income['month'] = df_income['date'].dt.to_period('M')
-        df_expense['month'] = df_expense['date'].dt.to_period('M')
-
-        income_by_month = df_income.groupby('month')['amount'].sum()
-        expense_by_month = df_expense.groupby('month')['amount'].sum()
-
-        plt.figure(figsize=(10, 6))
-        income_by_month.plot(kind='bar', color='green', label='Income')
-        expense_by_month.plot(kind='bar', color='red', label='Expense', alpha=0.7)
-        plt.legend()
-        plt.title('Income and Expense Over Time')
-        plt.xlabel('Month')
-        plt.ylabel('Amount')
-        plt.tight_layout()
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        plt.close()
-        return buffer
+        data = load_report_data(user_id, group_by='month')
+        months = sorted(set(data.income_totals).union(data.expense_totals))
+        if not months:
+            return None
+        positions = range(len(months))
+        figure = Figure(figsize=(10, 6))
+        ax = figure.add_subplot()
+        ax.bar(positions, [data.income_totals.get(m, 0) for m in months], width=0.5, color='green', label='Income')
+        ax.bar(positions, [data.expense_totals.get(m, 0) for m in months], width=0.5, color='red', label='Expense', alpha=0.7)
+        ax.set_xticks(positions, months, rotation=90)
+        ax.set_xlim(-0.5, len(months) - 0.5)
+        ax.legend()
+        ax.set_title('Income and Expense Over Time')
+        ax.set_xlabel('Month')
+        ax.set_ylabel('Amount')
+        return render_png(figure)
     elif graph_type == 'category_distribution':
         # Group by category
-        expense_by_category = df_expense.groupby('category')['amount'].sum()
-        plt.figure(figsize=(8, 8))
-        expense_by_category.plot(kind='pie', autopct='%1.1f%%')
-        plt.title('Expense Distribution by Category')
-        plt.ylabel('')
-        plt.tight_layout()
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        plt.close()
-        return buffer
+        data = load_report_data(user_id, group_by='category')
+        if not data.expense_totals:
+            return None
+        figure = Figure(figsize=(8, 8))
+        ax = figure.add_subplot()
+        ax.pie(list(data.expense_totals.values()), labels=list(data.expense_totals), autopct='%1.1f%%')
+        ax.set_title('Expense Distribution by Category')
+        return render_png(figure)
     else:
         return None
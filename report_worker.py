@@ -0,0 +1,176 @@
+# report_worker.py
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from constants import REPORT_WORKERS, REPORT_QUEUE_SIZE, REPORT_USER_LIMIT
+
+# submit_report() results
+REPORT_ACCEPTED = 'accepted'
+REPORT_QUEUE_FULL = 'queue_full'
+REPORT_USER_BUSY = 'user_busy'
+
+_lock = threading.Lock()
+_executor = None
+_queue_depth = 0
+_user_in_flight = {}
+_metrics = {
+    'submitted': 0,
+    'rejected_queue_full': 0,
+    'rejected_user_busy': 0,
+    'completed': 0,
+    'failed': 0,
+    'render_seconds_total': 0.0,
+    'render_seconds_max': 0.0,
+    'wait_seconds_total': 0.0,
+}
+
+
+def _init_worker():
+    logging.basicConfig(level=logging.INFO)
+    # The reporting stack (matplotlib, openpyxl) is only ever loaded here,
+    # never in the bot process
+    import report_generation  # noqa: F401
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def render_report(kind, args):
+    # Runs in a worker process; returns only picklable values. An Excel
+    # report is left in a temporary file, which the receiver sends and
+    # removes (see remove_report_file), so the workbook never passes through
+    # memory or the pipe back to the bot process
+    import report_generation
+    started = time.perf_counter()
+    payload = None
+    if kind == 'text':
+        payload = report_generation.create_text_report(*args)
+    elif kind == 'excel':
+        output = tempfile.NamedTemporaryFile(prefix='report-', suffix='.xlsx', delete=False)
+        try:
+            with output:
+                report = report_generation.create_report(*args, output=output)
+        except BaseException:
+            remove_report_file(output.name)
+            raise
+        if report:
+            payload = (output.name, report[1])
+        else:
+            remove_report_file(output.name)
+    elif kind == 'graph':
+        buffer = report_generation.create_graph_report(*args)
+        if buffer:
+            payload = buffer.getvalue()
+    return payload, time.perf_counter() - started
+
+
+def remove_report_file(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        logging.warning(f"Could not remove report file {path}: {e}")
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: workers must not inherit the dispatcher's threads or SQLite connections
+        _executor = ProcessPoolExecutor(
+            max_workers=REPORT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        )
+    return _executor
+
+
+def submit_report(user_id, kind, args, on_done):
+    # Queues a render; on_done(payload, error) is called from a pool thread
+    # when it finishes and should hand off any slow work (e.g. Bot API calls)
+    global _queue_depth, _executor
+    with _lock:
+        if _queue_depth >= REPORT_QUEUE_SIZE:
+            _metrics['rejected_queue_full'] += 1
+            return REPORT_QUEUE_FULL
+        if _user_in_flight.get(user_id, 0) >= REPORT_USER_LIMIT:
+            _metrics['rejected_user_busy'] += 1
+            return REPORT_USER_BUSY
+        _queue_depth += 1
+        _user_in_flight[user_id] = _user_in_flight.get(user_id, 0) + 1
+        _metrics['submitted'] += 1
+        submitted = time.perf_counter()
+        try:
+            future = _get_executor().submit(render_report, kind, args)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool
+            logging.error("Report worker pool is broken, restarting it")
+            _executor = None
+            future = _get_executor().submit(render_report, kind, args)
+
+    def done(future):
+        global _queue_depth
+        payload, error, render_seconds = None, None, 0.0
+        try:
+            payload, render_seconds = future.result()
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - submitted
+        with _lock:
+            _queue_depth -= 1
+            _user_in_flight[user_id] -= 1
+            if not _user_in_flight[user_id]:
+                del _user_in_flight[user_id]
+            _metrics['failed' if error else 'completed'] += 1
+            _metrics['render_seconds_total'] += render_seconds
+            _metrics['render_seconds_max'] = max(_metrics['render_seconds_max'], render_seconds)
+            _metrics['wait_seconds_total'] += elapsed - render_seconds
+            queue_depth = _queue_depth
+        logging.info(
+            f"Report {kind} for {user_id}: render {render_seconds:.3f}s, "
+            f"total {elapsed:.3f}s, queue depth {queue_depth}"
+        )
+        if error:
+            logging.error(f"Report {kind} for {user_id} failed: {error!r}")
+        on_done(payload, error)
+
+    future.add_done_callback(done)
+    return REPORT_ACCEPTED
+
+
+def warm_up_report_pool():
+    # Starts every worker in the background so the first report doesn't pay
+    # for process start-up and imports
+    started = time.perf_counter()
+    with _lock:
+        executor = _get_executor()
+        futures = [executor.submit(_warm_up) for _ in range(REPORT_WORKERS)]
+
+    def done(future):
+        if all(f.done() for f in futures):
+            logging.info(f"Report workers ready in {time.perf_counter() - started:.2f}s")
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def get_metrics():
+    with _lock:
+        metrics = dict(_metrics)
+        metrics['queue_depth'] = _queue_depth
+        metrics['users_in_flight'] = len(_user_in_flight)
+    finished = metrics['completed'] + metrics['failed']
+    metrics['render_seconds_avg'] = metrics['render_seconds_total'] / finished if finished else 0.0
+    return metrics
+
+
+def shutdown_report_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
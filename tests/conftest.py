@@ -0,0 +1,34 @@
+# tests/conftest.py
+#
+# Puts the repository on sys.path, and gives every test that asks for the
+# database fixture a database of its own.
+
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# constants reads the path once, on import; the database fixture points
+# db_functions elsewhere, so this file is never meant to be used
+os.environ['BOT_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'unused.db')
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # A migrated database in the test's own directory, a fresh connection
+    # and an empty profile cache; yields the connection
+    from cachetools import TTLCache
+    import db_functions
+    from constants import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL
+
+    monkeypatch.setattr(db_functions, 'DB_PATH', str(tmp_path / 'bot.db'))
+    monkeypatch.setattr(db_functions, '_local', threading.local())
+    monkeypatch.setattr(db_functions, '_profiles', TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL))
+    db_functions.init_db()
+    conn = db_functions.get_connection()
+    yield conn
+    conn.close()
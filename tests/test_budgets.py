@@ -0,0 +1,122 @@
+# tests/test_budgets.py
+#
+# A family member's expense against their remaining budget in each
+# BUDGET_ENFORCEMENT mode: the check when it's saved, the deduction when the
+# head approves it (guarded by budget >= amount with 'reject'), a member
+# without a budget having no limit, and each transaction decided only once.
+
+import pytest
+
+import db_functions
+from db_functions import (
+    ALREADY_DECIDED,
+    APPROVED,
+    BUDGET_FLAGGED,
+    BUDGET_OK,
+    BUDGET_REJECTED,
+    OVER_BUDGET,
+)
+
+HEAD, MEMBER = 1, 2
+
+
+@pytest.fixture
+def family(database):
+    for user_id in (HEAD, MEMBER):
+        db_functions.set_user_language(user_id, 'uz')
+    family_id = db_functions.create_family('Test', HEAD)
+    db_functions.join_family(MEMBER, family_id)
+    return family_id
+
+
+@pytest.fixture
+def enforcement(monkeypatch):
+    def set_mode(mode):
+        monkeypatch.setattr(db_functions, 'BUDGET_ENFORCEMENT', mode)
+    return set_mode
+
+
+def save_expense(amount):
+    return db_functions.save_expense(MEMBER, {
+        'expense_amount': amount,
+        'expense_currency': 'UZS',
+        'expense_category': 'Sport',
+        'expense_comment': '',
+    })
+
+
+def approve(saved):
+    return db_functions.approve_transaction(saved.transaction_id, 'expense')
+
+
+def budget():
+    return db_functions.get_user_budget(MEMBER)
+
+
+@pytest.mark.parametrize('mode', ['off', 'flag', 'reject'])
+def test_no_budget_is_no_limit(family, enforcement, mode):
+    enforcement(mode)
+    assert budget() is None
+    saved = save_expense(5.0)
+    assert (saved.status, saved.pending) == (BUDGET_OK, True)
+    assert approve(saved).status == APPROVED
+    assert budget() is None
+
+
+@pytest.mark.parametrize('mode, status', [
+    ('off', BUDGET_OK),
+    ('flag', BUDGET_FLAGGED),
+])
+def test_over_budget_allowed(family, enforcement, mode, status):
+    enforcement(mode)
+    assert db_functions.set_family_budget(family, 10.0) == 1
+    saved = save_expense(15.0)
+    assert (saved.status, saved.pending) == (status, True)
+    assert approve(saved).status == APPROVED
+    assert budget() == -5.0
+
+
+def test_over_budget_rejected(family, enforcement):
+    enforcement('reject')
+    db_functions.set_family_budget(family, 10.0)
+    saved = save_expense(15.0)
+    assert (saved.status, saved.transaction_id) == (BUDGET_REJECTED, None)
+    assert budget() == 10.0
+
+
+def test_approval_needs_remaining_budget(family, enforcement):
+    # Both fit the budget when saved, only one when approved
+    enforcement('reject')
+    db_functions.set_family_budget(family, 10.0)
+    first, second = save_expense(6.0), save_expense(6.0)
+    assert (first.status, second.status) == (BUDGET_OK, BUDGET_OK)
+    approval = approve(first)
+    assert approval.status == APPROVED
+    assert ('family_id', family) in approval.scopes
+    assert approve(second) == (OVER_BUDGET, ())
+    assert budget() == 4.0
+    # Still pending, the head can reject it
+    assert db_functions.reject_transaction(second.transaction_id, 'expense') is None
+
+
+def test_decided_once(family, enforcement):
+    enforcement('off')
+    db_functions.set_family_budget(family, 10.0)
+    saved = save_expense(4.0)
+    assert approve(saved).status == APPROVED
+    assert approve(saved) == (ALREADY_DECIDED, ())
+    assert db_functions.reject_transaction(saved.transaction_id, 'expense') == ALREADY_DECIDED
+    assert budget() == 6.0
+
+    rejected = save_expense(3.0)
+    assert db_functions.reject_transaction(rejected.transaction_id, 'expense') is None
+    assert approve(rejected) == (ALREADY_DECIDED, ())
+    assert budget() == 6.0
+
+
+def test_zero_budgets_become_unset(database):
+    # Databases from before budgets could be unset
+    database.execute("INSERT INTO users (user_id, role, budget) VALUES (5, 'member', 0), (6, 'member', 3)")
+    db_functions._unset_zero_budgets(database)
+    budgets = dict(database.execute('SELECT user_id, budget FROM users WHERE user_id IN (5, 6)'))
+    assert budgets == {5: None, 6: 3.0}
@@ -0,0 +1,61 @@
+# tests/test_chat_dispatcher.py
+#
+# Updates of different users run concurrently up to the limit, each user's
+# one at a time and in the order received, and a user's queued updates
+# don't hold slots.
+
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from chat_dispatcher import ChatOrderedUpdateProcessor
+
+
+def message_update(update_id, user_id):
+    chat = Chat(user_id, 'private')
+    user = User(user_id, 'Test', False)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user))
+
+
+def run_updates(limit, user_updates):
+    # user_updates: (user_id, number of updates) in the order they arrive;
+    # returns (user_id, index) in the order handled and the peak concurrency
+    handled = []
+    running = [0, 0]
+
+    async def handle(user_id, index):
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        handled.append((user_id, index))
+        running[0] -= 1
+
+    async def main():
+        processor = ChatOrderedUpdateProcessor(limit)
+        await processor.initialize()
+        tasks = []
+        update_id = 0
+        for user_id, count in user_updates:
+            for index in range(count):
+                update_id += 1
+                tasks.append(processor.process_update(message_update(update_id, user_id), handle(user_id, index)))
+        await asyncio.gather(*tasks)
+        assert not processor._locks
+
+    asyncio.run(main())
+    return handled, running[1]
+
+
+def test_per_user_order_and_limit():
+    handled, peak = run_updates(2, [(1, 5), (2, 5), (3, 5)])
+    assert peak == 2
+    for user_id in (1, 2, 3):
+        assert [index for user, index in handled if user == user_id] == list(range(5))
+
+
+def test_burst_does_not_hold_slots():
+    # User 1's queued updates wait for its lock, not for a slot
+    handled, peak = run_updates(4, [(1, 10), (2, 1), (3, 1)])
+    assert peak == 3
+    assert handled.index((2, 0)) < handled.index((1, 1))
@@ -0,0 +1,103 @@
+# tests/test_query_plans.py
+#
+# The report and budget queries must find their rows through an index or
+# primary key. Each query is run against an empty database created by
+# init_db() and its EXPLAIN QUERY PLAN checked for a SEARCH, and for no SCAN,
+# of the transaction and user tables.
+
+from contextlib import contextmanager
+
+import pytest
+
+import db_functions
+import report_data
+
+INDEXED_TABLES = ('incomes', 'expenses', 'users')
+
+SCOPES = [('user_id', 1), ('family_id', 1)]
+PERIODS = [None, 'weekly', 'monthly']
+
+pytestmark = pytest.mark.usefixtures('database')
+
+
+def query_plan(sql, params):
+    conn = db_functions.get_connection()
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def assert_indexed(sql, params, tables):
+    plan = query_plan(sql, params)
+    for table in INDEXED_TABLES:
+        scans = [step for step in plan if step.startswith(f'SCAN {table}')]
+        assert not scans, f'{sql}\n{plan}'
+    for table in tables:
+        assert any(step.startswith(f'SEARCH {table} ') for step in plan), f'{sql}\n{plan}'
+
+
+class RecordingCursor:
+    # Stands in for a cursor, keeps the statements instead of running them
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, params))
+        return self
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def fetchmany(self, size=None):
+        return []
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    cursor = RecordingCursor()
+
+    @contextmanager
+    def recording():
+        yield cursor
+
+    monkeypatch.setattr(report_data, 'read_snapshot', recording)
+    monkeypatch.setattr(db_functions, 'transaction', recording)
+    return cursor.statements
+
+
+@pytest.mark.parametrize('group_by', sorted(report_data.GROUP_BY))
+@pytest.mark.parametrize('period', PERIODS)
+@pytest.mark.parametrize('scope', SCOPES)
+def test_totals_query(scope, period, group_by):
+    since = report_data.get_period_start(period) if period else None
+    tables = ('incomes', 'expenses') if since else ()
+    assert_indexed(*report_data._totals_query(scope, since, group_by), tables)
+
+
+@pytest.mark.parametrize('table', ['incomes', 'expenses'])
+@pytest.mark.parametrize('period', PERIODS)
+@pytest.mark.parametrize('scope', SCOPES)
+def test_iter_rows(table, scope, period):
+    since = report_data.get_period_start(period) if period else None
+    cursor = RecordingCursor()
+    assert list(report_data._iter_rows(cursor, table, scope, since)) == []
+    (sql, params), = cursor.statements
+    assert_indexed(sql, params, (table,))
+
+
+def test_get_data_version(recorded):
+    assert report_data.get_data_version(1) == (('user_id', 1), 0)
+    (scope_sql, scope_params), (version_sql, version_params) = recorded
+    assert_indexed(scope_sql, scope_params, ('users',))
+    assert query_plan(version_sql, version_params) == [
+        'SEARCH scope_versions USING PRIMARY KEY (scope_type=? AND scope_id=?)'
+    ]
+
+
+def test_set_family_budget(recorded):
+    assert db_functions.set_family_budget(1, 100) == 0
+    assert recorded
+    for sql, params in recorded:
+        assert_indexed(sql, params, ('users',))
@@ -0,0 +1,34 @@
+# tests/test_quick_add.py
+#
+# One-line transactions: amounts, and categories stored in the user's
+# language whichever language they were typed in.
+
+import pytest
+
+from quick_add import QuickEntry, UnknownCategory, parse_quick_add
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('-5,5 UZS Sport', QuickEntry('expense', 5.5, 'UZS', 'Sport', '')),
+    ('-5000 UZS Sport futbol', QuickEntry('expense', 5000.0, 'UZS', 'Sport', 'futbol')),
+    ('+500 usd oylik', QuickEntry('income', 500.0, 'USD', 'Oylik maosh', '')),
+])
+def test_parse(text, expected):
+    assert parse_quick_add(text, 'uz') == expected
+
+
+@pytest.mark.parametrize('text', ['-5,000 UZS Sport', '-5.000 UZS Sport', '+5,000 USD Oylik maosh'])
+def test_ambiguous_amount(text):
+    with pytest.raises(ValueError) as raised:
+        parse_quick_add(text, 'uz')
+    # Answered with the format help, not the category list
+    assert not isinstance(raised.value, UnknownCategory)
+
+
+@pytest.mark.parametrize('text, language, category', [
+    ('-100 UZS Продукты', 'uz', 'Oziq-ovqat'),
+    ('-100 UZS Oziq-ovqat', 'ru', 'Продукты'),
+    ('-100 UZS Dam olish', 'uz', 'Dam olish'),
+])
+def test_category_in_user_language(text, language, category):
+    assert parse_quick_add(text, language).category == category
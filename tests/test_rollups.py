@@ -0,0 +1,118 @@
+# tests/test_rollups.py
+#
+# daily_totals kept up to date by saves, approvals and imports must equal
+# a rebuild from the transaction tables (including legacy rows with a NULL
+# currency or category), and period totals read through it must equal the
+# sums of the transactions in the period, which usually starts mid-day.
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import db_functions
+import report_data
+
+
+def test_rebuild_merges_null_and_empty(database):
+    with db_functions.transaction() as c:
+        c.executemany(
+            '''INSERT INTO expenses (user_id, date, amount, currency, category, comment, family_id, approved)
+               VALUES (1, '2024-05-01 10:00:00', ?, ?, ?, '', 7, 1)''',
+            [(100, None, None), (50, '', ''), (25, None, '')],
+        )
+    # One row per scope
+    assert db_functions.rebuild_rollups() == 2
+    rows = database.execute(
+        'SELECT scope_type, currency, category, total + remainder, count FROM daily_totals ORDER BY scope_type'
+    ).fetchall()
+    assert rows == [('family_id', '', '', 175, 3), ('user_id', '', '', 175, 3)]
+
+
+def daily_totals(conn):
+    # Rows of daily_totals with total + remainder as one value
+    return {
+        row[:6]: (row[6], row[7])
+        for row in conn.execute(
+            'SELECT scope_type, scope_id, day, kind, currency, category, total + remainder, count FROM daily_totals'
+        )
+    }
+
+
+def assert_same_totals(incremental, rebuilt):
+    assert incremental.keys() == rebuilt.keys()
+    for key, (total, count) in incremental.items():
+        assert count == rebuilt[key][1], key
+        assert total == pytest.approx(rebuilt[key][0], rel=1e-12, abs=1e-9), key
+
+
+def user_data(kind, amount, currency, category):
+    # What the income/expense flows collect
+    return {
+        f'{kind}_amount': amount,
+        f'{kind}_currency': currency,
+        f'{kind}_category': category,
+        f'{kind}_comment': '',
+    }
+
+
+def test_incremental_updates_match_rebuild(database):
+    head, member, single = 10, 11, 12
+    for user_id in (head, member, single):
+        db_functions.set_user_language(user_id, 'uz')
+    family_id = db_functions.create_family('Test', head)
+    db_functions.join_family(member, family_id)
+
+    for amount in (0.1, 0.2, 0.3, 1e6, 7.77):
+        db_functions.save_income(head, user_data('income', amount, 'UZS', 'Oylik maosh'))
+        db_functions.save_expense(single, user_data('expense', amount, 'USD', 'Sport'))
+        saved = db_functions.save_expense(member, user_data('expense', amount, 'UZS', 'Sport'))
+        assert saved.pending
+        db_functions.approve_transaction(saved.transaction_id, 'expense')
+    # Left pending, not counted by either
+    db_functions.save_expense(member, user_data('expense', 5.0, 'UZS', 'Sport'))
+    day = datetime.now() - timedelta(days=3)
+    db_functions.insert_transactions(head, family_id, [
+        ('incomes', day, 0.1, 'USD', "Sovg'a", ''),
+        ('expenses', day, 0.7, 'USD', 'Transport', ''),
+        ('expenses', day, 0.2, 'USD', 'Transport', ''),
+    ])
+
+    incremental = daily_totals(database)
+    db_functions.rebuild_rollups()
+    assert_same_totals(incremental, daily_totals(database))
+
+
+@pytest.mark.parametrize('group_by', sorted(report_data.GROUP_BY))
+@pytest.mark.parametrize('period', ['weekly', 'monthly'])
+def test_period_totals_match_rows(database, period, group_by):
+    user_id = 1
+    db_functions.set_user_language(user_id, 'uz')
+    start = datetime.now() - timedelta(days=report_data.PERIOD_DAYS[period])
+    # Around the period start on its first day, and whole days on either side
+    dates = [
+        start - timedelta(days=1),
+        start - timedelta(minutes=1),
+        start + timedelta(minutes=1),
+        start + timedelta(days=1),
+        datetime.now() - timedelta(minutes=1),
+    ]
+    rows = []
+    for i, date in enumerate(dates):
+        rows.append(('incomes', date, 100.0 + i, 'USD', 'Oylik maosh', ''))
+        rows.append(('expenses', date, 0.1 * (i + 1), 'UZS', 'Sport', ''))
+    db_functions.insert_transactions(user_id, None, rows)
+
+    with report_data.open_report_data(user_id, period, group_by) as data:
+        totals = (data.income_totals, data.expense_totals)
+        since = data.since
+    row_key = report_data.GROUP_BY[group_by][1]
+    for table, kind in db_functions.ROLLUP_KINDS.items():
+        expected = {
+            key: total
+            for key, total in database.execute(
+                f'SELECT {row_key}, SUM(amount) FROM {table} WHERE user_id = ? AND approved = 1 AND date >= ? '
+                f'GROUP BY 1',
+                (user_id, since),
+            )
+        }
+        assert totals[kind] == pytest.approx(expected)
@@ -0,0 +1,92 @@
+# tests/test_transaction_import.py
+#
+# Rows of an imported file: amounts whose separators could mean thousands
+# or decimals are rejected rather than guessed, and categories are stored
+# in the importing user's language. A file that breaks part-way reports how
+# far it was saved, and only a first row with no date or amount is a header.
+
+import asyncio
+
+import pytest
+
+import transaction_import
+
+
+def row(amount, category='Oziq-ovqat'):
+    return ['2024-05-01', amount, 'UZS', category, 'tushlik']
+
+
+@pytest.mark.parametrize('amount, expected', [
+    ('-5,5', 5.5),
+    ('-5000', 5000.0),
+    ('-5,000.00', 5000.0),
+    ('-1,250,000', 1250000.0),
+    (-5000, 5000.0),
+])
+def test_amount(amount, expected):
+    table, _, parsed, *_ = transaction_import.parse_row(row(amount), 'uz')
+    assert (table, parsed) == ('expenses', expected)
+
+
+@pytest.mark.parametrize('amount', ['-5,000', '-5.000', '5,000', '5.000', '1.234,56', '1,25,000'])
+def test_ambiguous_amount(amount):
+    with pytest.raises(ValueError):
+        transaction_import.parse_row(row(amount), 'uz')
+
+
+@pytest.mark.parametrize('category, language, expected', [
+    ('Продукты', 'uz', 'Oziq-ovqat'),
+    ('🛒 Oziq-ovqat', 'ru', 'Продукты'),
+    ('oziq-ovqat', 'uz', 'Oziq-ovqat'),
+])
+def test_category_in_user_language(category, language, expected):
+    *_, stored, _ = transaction_import.parse_row(row('-100', category), language)
+    assert stored == expected
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    # Chunks handed to the database instead of writing them
+    monkeypatch.setattr(transaction_import, 'IMPORT_CHUNK_SIZE', 100)
+    return []
+
+
+def import_csv(text, chunks):
+    async def insert_transactions(user_id, family_id, rows):
+        chunks.append(list(rows))
+        return [('user_id', user_id)]
+
+    return asyncio.run(
+        transaction_import.import_transactions(1, None, 'uz', 'rows.csv', text, insert_transactions)
+    )
+
+
+def test_header_skipped(inserted):
+    result = import_csv('date,amount,currency,category\n2024-05-01,-100,UZS,Sport\n'.encode(), inserted)
+    assert (result.accepted, result.rejected, result.stopped_after) == (1, 0, None)
+
+
+def test_invalid_first_row_rejected(inserted):
+    result = import_csv('2024-05-01,-5.000,UZS,Sport\n2024-05-01,-100,UZS,Sport\n'.encode(), inserted)
+    assert (result.accepted, result.rejected, result.rejected_lines) == (1, 1, (1,))
+
+
+def test_unreadable_part_keeps_saved_chunks(inserted):
+    # Fails to decode well after the first chunks were written
+    content = '2024-05-01,-100,UZS,Sport,tushlik\n'.encode() * 1000 + 'Спорт'.encode('cp1251')
+    result = import_csv(content, inserted)
+    assert result.accepted == sum(len(chunk) for chunk in inserted) > 0
+    assert result.stopped_after == result.accepted
+
+
+def test_unreadable_file_raises(inserted):
+    with pytest.raises(UnicodeDecodeError):
+        import_csv('2024-05-01,-100,UZS,Спорт\n'.encode('cp1251'), inserted)
+    assert inserted == []
+
+
+def test_chunks(inserted):
+    content = '2024-05-01,-100,UZS,Sport\n'.encode() * 250
+    result = import_csv(content, inserted)
+    assert [len(chunk) for chunk in inserted] == [100, 100, 50]
+    assert (result.accepted, result.stopped_after) == (250, None)
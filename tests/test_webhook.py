@@ -0,0 +1,64 @@
+# tests/test_webhook.py
+#
+# The update endpoint answers 400, and queues nothing, for bodies that are
+# not a JSON object. /metrics serves the counters main.py logs.
+
+import asyncio
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application as WebApplication
+
+from webhook import MetricsHandler, UpdateHandler
+
+SECRET = 'test-secret'
+
+
+class FakeApplication:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+class FakeRunner:
+    secret = SECRET
+
+    def __init__(self):
+        self.application = FakeApplication()
+
+    def is_ready(self):
+        return True
+
+
+class UpdateHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.runner = FakeRunner()
+        return WebApplication([('/telegram', UpdateHandler, {'runner': self.runner})])
+
+    def post(self, body):
+        return self.fetch(
+            '/telegram', method='POST', body=body, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}
+        )
+
+    def test_update(self):
+        assert self.post('{"update_id": 1}').code == 200
+        assert self.runner.application.update_queue.qsize() == 1
+
+    def test_not_an_object(self):
+        for body in ('[]', '[{"update_id": 1}]', '"update"', '1', 'null', '{'):
+            assert self.post(body).code == 400, body
+        assert self.runner.application.update_queue.empty()
+
+
+class MetricsHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return WebApplication([('/metrics', MetricsHandler, {'runner': FakeRunner()})])
+
+    def test_metrics(self):
+        response = self.fetch('/metrics')
+        assert response.code == 200
+        assert response.headers['Content-Type'] == 'application/json'
+        metrics = json.loads(response.body)
+        assert set(metrics) == {'report_workers', 'chart_cache', 'profile_cache', 'outbound'}
+        assert metrics['report_workers']['queue_depth'] == 0
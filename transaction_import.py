@@ -0,0 +1,228 @@
+# transaction_import.py
+#
+# Imports transactions from a CSV or XLSX file sent to the bot. Every row is
+# date, amount, currency, category and an optional comment; a negative
+# amount is an expense, a positive one an income. A first row with no date
+# or amount in it is a header and skipped.
+# Categories may be written in either language and are stored under their
+# name in the importing user's language.
+# Valid rows are written IMPORT_CHUNK_SIZE at a time, one transaction each,
+# so the import never holds the database (or a database thread) for long; invalid rows are counted
+# and their line numbers reported. A file that fails part-way keeps the
+# chunks written before, and the result says up to which line.
+
+import asyncio
+import csv
+import functools
+import io
+import logging
+import math
+from datetime import datetime
+from typing import NamedTuple
+from utilities import sanitize_comment
+from localization import category_name
+from constants import CURRENCIES, IMPORT_CHUNK_SIZE
+
+# Line numbers of rejected rows reported back to the user
+MAX_REPORTED_LINES = 10
+
+DATE_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y', '%d/%m/%Y')
+
+CSV_DELIMITERS = ',;\t'
+
+CURRENCY_CODES = frozenset(CURRENCIES)
+
+
+class ImportResult(NamedTuple):
+    accepted: int
+    rejected: int
+    # The first MAX_REPORTED_LINES of them
+    rejected_lines: tuple
+    # Report scopes whose totals changed
+    scopes: tuple
+    # Line of the last row saved when the import stopped part-way, else None
+    stopped_after: object
+
+
+def _strip_thousands(integer, value):
+    # "1,250,000" -> "1250000"; the groups after the first have three digits
+    groups = integer.split(',')
+    if any(len(group) != 3 for group in groups[1:]):
+        raise ValueError(f"Invalid amount {value!r}")
+    return ''.join(groups)
+
+
+def parse_amount(value):
+    if isinstance(value, (int, float)):
+        amount = float(value)
+    else:
+        text = str(value).strip().replace('\xa0', '').replace(' ', '')
+        integer, dot, fraction = text.partition('.')
+        if dot:
+            # Decimal dot, commas before it separate thousands; "5.000" may
+            # be five thousand with a dot separator
+            if len(fraction) == 3 or ',' in fraction:
+                raise ValueError(f"Ambiguous amount {value!r}")
+            text = f"{_strip_thousands(integer, value)}.{fraction}"
+        elif text.count(',') == 1:
+            # Decimal comma; "5,000" may be five thousand
+            integer, _, fraction = text.partition(',')
+            if len(fraction) == 3:
+                raise ValueError(f"Ambiguous amount {value!r}")
+            text = f"{integer}.{fraction}"
+        else:
+            text = _strip_thousands(text, value)
+        amount = float(text)
+    if not math.isfinite(amount) or amount == 0:
+        raise ValueError(f"Invalid amount {value!r}")
+    return amount
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        # Stored like the dates of transactions entered in chat, without a zone
+        return value.replace(tzinfo=None)
+    return _parse_date_text(str(value).strip())
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    # Cached: a file has far fewer distinct dates than rows, and strptime is
+    # the slowest part of reading a row
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date {text!r}")
+
+
+def parse_row(cells, language):
+    # (table, date, amount, currency, category, comment) with the category
+    # named in the language, ValueError if the row isn't a valid transaction
+    cells = list(cells) + [None] * (5 - len(cells))
+    date, amount, currency, category, comment = cells[:5]
+    if date is None or amount is None or currency is None or category is None:
+        raise ValueError("Missing column")
+    amount = parse_amount(amount)
+    table = 'expenses' if amount < 0 else 'incomes'
+    currency = str(currency).strip().upper()
+    if currency not in CURRENCY_CODES:
+        raise ValueError(f"Unknown currency {currency!r}")
+    stored_category = category_name(table, str(category), language)
+    if stored_category is None:
+        raise ValueError(f"Unknown category {category!r}")
+    comment = '' if comment is None else str(comment).strip()
+    return table, parse_date(date), abs(amount), currency, stored_category, sanitize_comment(comment)
+
+
+def read_csv(content):
+    text = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS)
+    except csv.Error:
+        dialect = csv.excel
+    for row in csv.reader(text, dialect):
+        # Empty strings are missing values, as empty cells are in XLSX
+        yield [cell if cell.strip() else None for cell in row]
+
+
+def read_xlsx(content):
+    # openpyxl is only loaded for imports
+    from openpyxl import load_workbook
+    workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(file_name, content):
+    if file_name.lower().endswith('.xlsx'):
+        return read_xlsx(content)
+    return read_csv(content)
+
+
+def _is_header(cells):
+    # A row none of whose cells reads as a date or an amount
+    for cell in cells:
+        if cell is None:
+            continue
+        for parse in (parse_date, parse_amount):
+            try:
+                parse(cell)
+            except (ValueError, TypeError):
+                continue
+            return False
+    return True
+
+
+class ChunkReader:
+    # Reads a file's valid rows IMPORT_CHUNK_SIZE at a time and counts the
+    # invalid ones. Calls must not overlap, but each may run on any thread.
+
+    def __init__(self, file_name, content, language):
+        self.language = language
+        self.rows = enumerate(read_rows(file_name, content), start=1)
+        self.first_row = True
+        self.rejected = 0
+        self.rejected_lines = []
+
+    def next_chunk(self):
+        # (rows, line of the last one read); no rows at the end of the file
+        chunk = []
+        line = 0
+        for line, cells in self.rows:
+            if not any(cell is not None for cell in cells):
+                continue
+            try:
+                chunk.append(parse_row(cells, self.language))
+            except (ValueError, TypeError):
+                if self.first_row and _is_header(cells):
+                    self.first_row = False
+                    continue
+                self.first_row = False
+                self.rejected += 1
+                if len(self.rejected_lines) < MAX_REPORTED_LINES:
+                    self.rejected_lines.append(line)
+                continue
+            self.first_row = False
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                break
+        return chunk, line
+
+
+async def import_transactions(user_id, family_id, language, file_name, content, insert):
+    # The file is read and checked on a worker thread (asyncio.to_thread),
+    # and each chunk handed to insert(user_id, family_id, rows), a coroutine
+    # function that writes it in one transaction and returns the scopes it
+    # changed; the database threads only ever run the inserts. With nothing
+    # written yet a read or write error is raised, after that it ends the
+    # import with stopped_after set.
+    reader = ChunkReader(file_name, content, language)
+    accepted = 0
+    scopes = set()
+    # Line of the last row of the last chunk written
+    saved_line = 0
+    try:
+        while True:
+            chunk, line = await asyncio.to_thread(reader.next_chunk)
+            if not chunk:
+                break
+            scopes.update(await insert(user_id, family_id, chunk))
+            accepted += len(chunk)
+            saved_line = line
+    except Exception as e:
+        if not accepted:
+            raise
+        logging.error(f"Import of {file_name} for {user_id} stopped after line {saved_line}: {e}")
+        stopped_after = saved_line
+    else:
+        stopped_after = None
+    return ImportResult(accepted, reader.rejected, tuple(reader.rejected_lines), tuple(scopes), stopped_after)
@@ -1,35 +1,23 @@
 # utilities.py
 
-import logging
-from telegram import ReplyKeyboardRemove
+
+# outbound (and with it the Bot API client) is imported where it's used:
+# db_functions imports this module, including in the report worker processes
 
 def delete_previous_bot_message(update, context):
+    from outbound import delete_soon
     if 'last_bot_message_id' in context.user_data:
-        try:
-            context.bot.delete_message(
-                chat_id=update.effective_chat.id, message_id=context.user_data['last_bot_message_id']
-            )
-        except Exception as e:
-            logging.warning(f"Failed to delete bot message: {e}")
+        delete_soon(context.application, update.effective_chat.id, context.user_data['last_bot_message_id'])
 
 
 def delete_user_message(update, context):
-    try:
-        context.bot.delete_message(
-            chat_id=update.effective_chat.id, message_id=update.message.message_id
-        )
-    except Exception as e:
-        logging.warning(f"Failed to delete user message: {e}")
-
-
-def delete_message(context):
-    job = context.job
-    chat_id = job.context['chat_id']
-    message_id = job.context['message_id']
-    try:
-        context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception as e:
-        logging.warning(f"Failed to delete message: {e}")
+    from outbound import delete_soon
+    delete_soon(context.application, update.effective_chat.id, update.message.message_id)
+
+
+def delete_message_later(context, chat_id, message_id, delay=3):
+    from outbound import delete_soon
+    delete_soon(context.application, chat_id, message_id, delay)
 
 
 def sanitize_comment(comment):
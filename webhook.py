@@ -0,0 +1,175 @@
+# webhook.py
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+from telegram import Update
+from constants import (
+    TOKEN,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_DRAIN_TIMEOUT,
+)
+from report_worker import get_metrics
+from chart_cache import get_cache_stats
+from db_functions import get_profile_cache_stats
+from outbound import get_outbound_stats
+
+# Telegram never sends more than this in one update
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookRequestHandler(RequestHandler):
+    def initialize(self, runner):
+        self.runner = runner
+
+    def set_default_headers(self):
+        self.set_header('Server', 'FinansBot')
+        self.set_header('Content-Type', 'text/plain')
+
+    def reply(self, status, text):
+        self.set_status(status)
+        self.finish(text)
+
+
+class HealthHandler(WebhookRequestHandler):
+    def get(self):
+        # The process is up and serving HTTP
+        self.reply(200, 'ok')
+
+
+class ReadinessHandler(WebhookRequestHandler):
+    def get(self):
+        # Safe to route updates here
+        if self.runner.is_ready():
+            self.reply(200, 'ready')
+        else:
+            self.reply(503, 'not ready')
+
+
+class MetricsHandler(WebhookRequestHandler):
+    def get(self):
+        # The counters main.py logs every METRICS_LOG_INTERVAL
+        metrics = {
+            'report_workers': get_metrics(),
+            'chart_cache': get_cache_stats(),
+            'profile_cache': get_profile_cache_stats(),
+            'outbound': get_outbound_stats(),
+        }
+        self.set_header('Content-Type', 'application/json')
+        self.reply(200, json.dumps(metrics))
+
+
+class UpdateHandler(WebhookRequestHandler):
+    async def post(self):
+        runner = self.runner
+        token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token.encode(), runner.secret.encode()):
+            self.reply(403, 'forbidden')
+            return
+        if not runner.is_ready():
+            # Telegram retries it once we are ready
+            self.reply(503, 'not ready')
+            return
+        try:
+            data = json.loads(self.request.body)
+            # A list, string or null is valid JSON but no update
+            if not isinstance(data, dict):
+                raise ValueError("Update is not a JSON object")
+            update = Update.de_json(data, runner.application.bot)
+        except (ValueError, KeyError, TypeError):
+            self.reply(400, 'bad request')
+            return
+        await runner.application.update_queue.put(update)
+        self.reply(200, 'ok')
+
+
+def derive_secret(token):
+    # Same across restarts, and a new one comes with a new token; Telegram
+    # allows A-Z, a-z, 0-9, _ and - in the secret
+    return hmac.new(token.encode(), b'webhook-secret', 'sha256').hexdigest()
+
+
+def log_request(handler):
+    request = handler.request
+    logging.debug(f"Webhook {request.remote_ip}: {request.method} {request.uri} {handler.get_status()}")
+
+
+class WebhookRunner:
+    # Runs the application behind our own HTTP server instead of long
+    # polling. run() mirrors Application.run_polling(): it blocks until
+    # SIGINT/SIGTERM and calls the post_init/post_shutdown hooks. Like
+    # polling it's for one process: conversation state, user_data and the
+    # per-user ordering are held in memory (see persistence), so one user's
+    # updates must not be spread over several.
+
+    def __init__(self, application):
+        self.application = application
+        # Registered with the webhook on every start; without a configured
+        # one it's derived from the token
+        self.secret = WEBHOOK_SECRET or derive_secret(TOKEN)
+        self.ready = False
+
+    def is_ready(self):
+        return self.ready and self.application.running
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        application = self.application
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        web_app = WebApplication(
+            [
+                ('/healthz', HealthHandler, {'runner': self}),
+                ('/readyz', ReadinessHandler, {'runner': self}),
+                ('/metrics', MetricsHandler, {'runner': self}),
+                (WEBHOOK_PATH, UpdateHandler, {'runner': self}),
+            ],
+            log_function=log_request,
+        )
+        httpd = HTTPServer(web_app, max_body_size=MAX_BODY_SIZE)
+        httpd.listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+        await application.bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=self.secret)
+        self.ready = True
+        logging.info(f"Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        await stop_event.wait()
+        await self.stop(httpd)
+
+    async def stop(self, httpd):
+        # Refuse new updates (readiness turns 503, Telegram retries them
+        # later), let the application finish the ones already received, then stop
+        self.ready = False
+        application = self.application
+        update_queue = application.update_queue
+        try:
+            await asyncio.wait_for(update_queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+            logging.info("All received updates handled, stopping")
+        except asyncio.TimeoutError:
+            logging.warning(f"Drain timed out, dropping {update_queue.qsize()} queued updates")
+            while not update_queue.empty():
+                update_queue.get_nowait()
+                update_queue.task_done()
+        httpd.stop()
+        await httpd.close_all_connections()
+        # Waits for the updates in progress and tasks such as report delivery
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)